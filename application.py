@@ -1,13 +1,81 @@
-from functools import lru_cache
+import hashlib
+import hmac
+import json
+import os
 
-from flask import Flask, render_template, request
+from flask import Flask, jsonify, render_template, request
+import numpy as np
 
 import car_purchase_help.model1 as model_1
 import car_purchase_help.model2 as model_2
 import car_purchase_help.model3 as model_3
-from car_purchase_help.utils import format_user_input, clean_input
+from car_purchase_help import constants
+from car_purchase_help.advice_cache import make_advice_cache, normalize_key
+from car_purchase_help.catalog import load_catalog
+from car_purchase_help.metrics import (
+    ADVICE_CACHE,
+    ERRORS,
+    STAGE_LATENCY,
+    latest_metrics,
+)
+from car_purchase_help.model_store import load_model_store
+from car_purchase_help.plots import get_plot_renderer
+from car_purchase_help.profiling import RequestProfiler
+from car_purchase_help.registry import get_registry
+from car_purchase_help.reload import (
+    install_signal_handler,
+    live_version,
+    request_reload,
+)
+from car_purchase_help.similar_cars import load_similar_cars_index
+from car_purchase_help.utils import clean_input, clean_user_input
 
 app = Flask(__name__)
+advice_cache = make_advice_cache()
+
+app.config["READY"] = False
+
+
+def profile_requested() -> bool:
+    """
+    :return: whether an admin asked for the current request to be profiled
+    """
+    return request.headers.get("X-Profile") == "1" and is_admin(request)
+
+
+# Profiling can only be forced when an admin token is configured
+profiler = RequestProfiler(
+    force=profile_requested if os.environ.get(constants.ADMIN_TOKEN_ENV) else None
+)
+
+
+def warm_up():
+    """
+    Loads everything the models need before the first request: the model store, the
+    catalog, the similar cars index and the preloaded regressions. When serving with
+    gunicorn this runs once in the master before the workers are forked so they share
+    the memory
+    """
+    store = load_model_store()
+    if store is not None:
+        # Fault the memory mapped pages in so the first requests do not
+        np.asarray(store.coefficients).sum()
+    load_catalog()
+    load_similar_cars_index()
+    if constants.REGISTRY_PRELOAD:
+        get_registry().preload(constants.REGISTRY_PRELOAD)
+    app.config["READY"] = True
+
+
+@app.after_request
+def add_model_version(response):
+    """
+    Reports the version of the models which served the request
+    """
+    version = live_version()
+    if version is not None:
+        response.headers["X-Model-Version"] = version
+    return response
 
 
 @app.route("/")
@@ -18,6 +86,38 @@ def landing_page():
     return render_template("landing.html")
 
 
+@app.route("/ready")
+def ready():
+    """
+    Readiness check, only succeeds once the warm up has finished
+    """
+    if app.config["READY"]:
+        return jsonify(ready=True, model_version=live_version())
+    return jsonify(ready=False), 503
+
+
+@app.route("/admin/reload", methods=["POST"])
+def admin_reload():
+    """
+    Loads the latest published version of the model store in the background, the
+    current version keeps serving until it is ready. Requires the admin token in
+    the X-Admin-Token header
+    """
+    if not is_admin(request):
+        return jsonify(error="Not found"), 404
+    request_reload()
+    return jsonify(reloading=True, model_version=live_version()), 202
+
+
+@app.route("/metrics")
+def metrics():
+    """
+    Prometheus metrics
+    """
+    body, content_type = latest_metrics()
+    return app.response_class(body, content_type=content_type)
+
+
 @app.route("/model1", methods=["POST", "GET"])
 def model1():
     """
@@ -42,6 +142,162 @@ def model3():
     return handle_request(request, "model3.html")
 
 
+@app.route("/api/v1/advice", methods=["POST", "GET"])
+def api_advice():
+    """
+    JSON version of the three models. A POST takes a JSON array of listings, a GET
+    takes a single listing as query parameters. Each listing has the fields
+    manufacturer, model, year, odometer and price
+    """
+    if request.method == "POST":
+        listings = request.get_json(silent=True)
+        if not isinstance(listings, list):
+            return jsonify(error="Expected a JSON array of listings"), 400
+        if len(listings) > constants.API_MAX_LISTINGS:
+            return (
+                jsonify(
+                    error=f"At most {constants.API_MAX_LISTINGS} listings per request"
+                ),
+                400,
+            )
+    else:
+        listings = [request.args.to_dict()]
+
+    results = [advice_for_listing(listing) for listing in listings]
+    return cacheable_json_response(results)
+
+
+@app.route("/api/v1/suggest")
+def api_suggest():
+    """
+    Autocompletes the manufacturer and model typed so far, given as the q parameter,
+    with the years that have a regression
+    """
+    text = request.args.get("q", "")
+    limit = min(
+        request.args.get("limit", constants.SUGGEST_LIMIT, type=int),
+        constants.SUGGEST_LIMIT,
+    )
+    return cacheable_json_response(load_catalog().suggest(text, limit))
+
+
+@app.route("/plot/<manufacturer>/<model>/<int:year>.png")
+def plot(manufacturer, model, year):
+    """
+    Scatter plot of the training data of a car with its regression line and deal
+    boundaries, rendered on the first request and served from a disk cache afterwards
+    """
+    try:
+        manufacturer, model, year, _ = clean_input(manufacturer, model, year, 1000)
+        load_catalog().validate(manufacturer, model, year)
+        renderer = get_plot_renderer()
+        assert renderer.has_training_data(
+            manufacturer, model, year
+        ), "No training data to plot for this car"
+    except Exception as error:
+        ERRORS.labels(type(error).__name__).inc()
+        return jsonify(error=str(error)), 404
+
+    png = renderer.get_png(manufacturer, model, year)
+    response = app.response_class(png, mimetype="image/png")
+    response.headers[
+        "Cache-Control"
+    ] = f"public, max-age={constants.PLOT_CACHE_MAX_AGE}"
+    return response
+
+
+def advice_for_listing(listing) -> dict:
+    """
+    Runs all three models for a single listing of the JSON API
+    :param listing: dictionary with the manufacturer, model, year, odometer and price
+    :return: dictionary of results, with an error message if the listing failed
+    """
+    result = {"input": listing, "error": None}
+    try:
+        assert isinstance(listing, dict), "Each listing must be a JSON object"
+        manufacturer, model, year, odometer, listed_price = (
+            str(listing["manufacturer"]),
+            str(listing["model"]),
+            int(listing["year"]),
+            int(listing["odometer"]),
+            int(listing["price"]),
+        )
+        manufacturer, model, year, odometer = clean_input(
+            manufacturer, model, year, odometer
+        )
+        load_catalog().validate(manufacturer, model, year)
+        predicted_price, mean_absolute_residual = model_1.predict_price(
+            manufacturer, model, year, odometer
+        )
+        similar_prices = model_3.get_similar_prices(manufacturer, model, year, odometer)
+        result.update(
+            {
+                "predicted_price": round(float(predicted_price), 2),
+                "mean_absolute_residual": round(float(mean_absolute_residual), 2),
+                "deal": model_1.get_deal_category(
+                    predicted_price, listed_price, mean_absolute_residual
+                ),
+                "mileage_decrease": round(
+                    float(model_2.get_mileage_decrease(manufacturer, model, year)), 2
+                ),
+                "similar": [
+                    {
+                        "manufacturer": car["manufacturer"],
+                        "model": car["model"],
+                        "predicted_price": round(float(car["predicted_price"]), 2),
+                        "mileage_decrease": round(float(car["mileage_decrease"]), 2),
+                    }
+                    for car in similar_prices or []
+                ],
+            }
+        )
+    except KeyError as error:
+        ERRORS.labels(type(error).__name__).inc()
+        result["error"] = f"Missing field {error}"
+    except Exception as error:
+        ERRORS.labels(type(error).__name__).inc()
+        result["error"] = str(error)
+    return result
+
+
+def cacheable_json_response(payload):
+    """
+    The models are deterministic so the same input always gives the same output.
+    The response carries an ETag of its body, and for GET and HEAD requests a
+    Cache-Control header, so a reverse proxy or client can reuse it
+    :param payload: object to be serialized
+    :return: a JSON response, or an empty 304 if the client of a GET or HEAD request
+        already has it. Other methods get a 412 when If-None-Match matches
+    """
+    body = json.dumps(payload, sort_keys=True)
+    # The same body from another version of the models is a different response
+    etag = hashlib.sha1(f"{live_version()}|{body}".encode("utf-8")).hexdigest()
+    # Conditional requests are only answered with 304 for GET and HEAD (RFC 7232)
+    safe = request.method in ("GET", "HEAD")
+    if etag in request.if_none_match:
+        response = app.response_class(status=304 if safe else 412)
+    else:
+        response = app.response_class(body, mimetype="application/json")
+    response.set_etag(etag)
+    if safe:
+        response.headers[
+            "Cache-Control"
+        ] = f"public, max-age={constants.API_CACHE_MAX_AGE}"
+    return response
+
+
+def is_admin(request) -> bool:
+    """
+    :param request: http request
+    :return: whether the request carries the admin token, always False when no
+        token is configured
+    """
+    token = os.environ.get(constants.ADMIN_TOKEN_ENV)
+    if not token:
+        return False
+    return hmac.compare_digest(request.headers.get("X-Admin-Token", ""), token)
+
+
 def get_model_from_template(template_name):
     """
     Get the name of the relevant model from the name of the template
@@ -51,40 +307,67 @@ def get_model_from_template(template_name):
     return template_name.split(".")[0]
 
 
-@lru_cache(maxsize=128)
+@profiler.profiled
 def retrieve_advice_from_model(user_raw_text, model_page):
     """
     This function computes or retrieves advice
-    We use an LRU cache to store results we process. If we see the same car details
-    twice, we can retrieve cached results to serve them faster
+    We use an LRU cache keyed on the cleaned input to store results we process. If we
+    see the same car details twice, we can retrieve cached results to serve them faster
     :param user_raw_text: the input text to the model eg honda, camry, 2013, 30000, 4000
     :param model: which model to use
     :return: a model's recommendations
     """
+    with STAGE_LATENCY.labels("parse").time():
+        car = clean_user_input(user_raw_text)
+        # Reject cars without a regression before running any model
+        load_catalog().validate(*car[:3])
 
-    manufacturer, model, year, odometer, listed_price = format_user_input(user_raw_text)
-    predicted_price, mean_absolute_residual = model_1.predict_price(
-        manufacturer, model, year, odometer
-    )
-    model1_advice = model_1.get_advice(
-        predicted_price, listed_price, mean_absolute_residual
-    )
+    key = normalize_key(car, model_page, live_version())
+    advice = advice_cache.get(key)
+    if advice is None:
+        ADVICE_CACHE.labels("miss").inc()
+        advice = compute_advice(car, model_page)
+        advice_cache.set(key, advice)
+    else:
+        ADVICE_CACHE.labels("hit").inc()
+    return advice
 
-    if model_page == "model1":
-        return model1_advice
 
-    mileage_decrease = model_2.predict_mileage_cost(manufacturer, model, year)
+def compute_advice(car, model_page):
+    """
+    Runs the models for the input
+    :param car: tuple of cleaned manufacturer, model, year, mileage, listed price
+    :param model: which model to use
+    :return: a model's recommendations
+    """
+    manufacturer, model, year, odometer, listed_price = car
+    with STAGE_LATENCY.labels("predict").time():
+        predicted_price, mean_absolute_residual = model_1.predict_price(
+            manufacturer, model, year, odometer
+        )
+        model1_advice = model_1.get_advice(
+            predicted_price, listed_price, mean_absolute_residual
+        )
+
+        if model_page == "model1":
+            return model1_advice
+
+        mileage_decrease = model_2.predict_mileage_cost(manufacturer, model, year)
 
     if model_page == "model2":
         return f"{model1_advice} {mileage_decrease}"
 
     if model_page == "model3":
-        similar_advice = model_3.get_similar_advice(manufacturer, model, year, odometer)
+        with STAGE_LATENCY.labels("similar").time():
+            similar_advice = model_3.get_similar_advice(
+                manufacturer, model, year, odometer
+            )
         return f"{model1_advice} {mileage_decrease}\n{similar_advice}"
 
     raise ValueError("Incorrect Model passed")
 
 
+@profiler.profiled
 def handle_request(request, template_name):
     """
     Renders an input form for GET requests and displays results for the given
@@ -101,19 +384,19 @@ def handle_request(request, template_name):
         # Attempt to get advice according to the model
         try:
             advice = retrieve_advice_from_model(car_info, model_name)
-            print(advice)
             payload = {
                 "input": car_info,
                 "advice": advice,
                 "model_name": model_name,
                 "error": "",
             }
-            return render_template("results.html", ml_result=payload)
+            with STAGE_LATENCY.labels("render").time():
+                return render_template("results.html", ml_result=payload)
 
         # There are various reasons this can fail. If it does render the error
         # page and let the user know what went wrong
         except Exception as error:
-            print(error)
+            ERRORS.labels(type(error).__name__).inc()
             payload = {
                 "input": car_info,
                 "advice": "",
@@ -124,3 +407,9 @@ def handle_request(request, template_name):
 
     else:
         return render_template(template_name)
+
+
+if __name__ == "__main__":
+    warm_up()
+    install_signal_handler()
+    app.run()
@@ -0,0 +1,70 @@
+"""
+Measures the cold start of the app: importing and warming it up in a fresh
+interpreter, as every new gunicorn master, autoscaled instance or serverless
+container does. Fails if it goes over budget or if serving imports the training
+and plotting dependencies:
+
+    python -m benchmarks.cold_start
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+import numpy as np
+
+# Median seconds to import and warm up wsgi.py
+COLD_START_BUDGET = 1.0
+# Modules only needed to train models or draw plots
+TRAINING_MODULES = ["pandas", "matplotlib", "sklearn", "scipy"]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import wsgi
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "modules": [
+    name for name in %r if name in sys.modules
+]}))
+""" % (
+    TRAINING_MODULES,
+)
+
+
+def measure_cold_start(runs: int = 5) -> dict:
+    """
+    :param runs: number of fresh interpreters to start
+    :return: dictionary of the median and worst seconds, and the training modules
+        that were imported
+    """
+    seconds, modules = [], set()
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE], check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        seconds.append(result["seconds"])
+        modules.update(result["modules"])
+    return {
+        "median": float(np.median(seconds)),
+        "max": float(np.max(seconds)),
+        "training_modules": sorted(modules),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=COLD_START_BUDGET)
+    args = parser.parse_args()
+
+    result = measure_cold_start(args.runs)
+    print(
+        f"Cold start median {result['median']:.3f}s, max {result['max']:.3f}s,"
+        f" budget {args.budget:.3f}s"
+    )
+    failed = result["median"] > args.budget
+    if result["training_modules"]:
+        print(f"Serving imported {', '.join(result['training_modules'])}")
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,259 @@
+"""
+Load test of the Flask endpoints with realistic listings drawn from the cars in the
+model store. Runs against a server on this machine, either one already started or
+one started by the tool:
+
+    python -m benchmarks.load_test --serve --concurrency 16 --requests 5000
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --hit-ratio 0.5
+
+The popular listings are sent before the timed requests so the advice cache holds
+them. The default memory cache is per worker and a worker only has the listings it
+was sent, so the requested hit ratio is only reached exactly with the sqlite
+backend shared by the workers. The achieved ratio is read from the cache metrics
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import re
+import subprocess
+import sys
+import time
+from urllib.error import URLError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+import numpy as np
+
+from benchmarks.synthetic import listings_as_text, synthetic_listings
+
+ERROR_MARKER = b"There was an error with your input"
+ADVICE_CACHE_METRIC = re.compile(
+    r'^car_help_advice_cache_total\{result="(hit|miss)"\} ([0-9.e+]+)$', re.M
+)
+
+
+def make_requests(
+    n: int, endpoints: list, hit_ratio: float, hot_set: int, seed: int
+) -> (list, list):
+    """
+    Builds the requests of the test. A `hit_ratio` fraction of them repeat one of
+    `hot_set` popular requests, which the advice cache serves once warmed up. Each
+    popular listing is always sent to the same endpoint, as the cache key includes
+    the endpoint. The rest are all different
+    :param n: number of requests
+    :param endpoints: endpoints to spread the requests over, eg model1
+    :param hit_ratio: fraction of requests repeating a popular listing
+    :param hot_set: number of popular listings
+    :param seed: random seed
+    :return: tuple of the list of (endpoint, car_info text) of the test and the list
+        of the popular ones
+    """
+    rng = np.random.default_rng(seed)
+    listings = synthetic_listings(n + hot_set, seed)
+    # Distinct listed prices make every cold request a distinct cache key
+    listings["price"] += np.arange(len(listings))
+    texts = listings_as_text(listings)
+    hot = [
+        (endpoints[i % len(endpoints)], text) for i, text in enumerate(texts[:hot_set])
+    ]
+    cold = texts[hot_set:]
+
+    requests = []
+    for i in range(n):
+        if rng.random() < hit_ratio:
+            requests.append(hot[rng.integers(0, len(hot))])
+        else:
+            requests.append((endpoints[rng.integers(0, len(endpoints))], cold[i]))
+    return requests, hot
+
+
+def send(url: str, endpoint: str, text: str, timeout: float) -> tuple:
+    """
+    :return: tuple of endpoint, latency in seconds and the outcome, one of ok,
+        input_error (the app rendered its error page) or the HTTP/connection error
+    """
+    data = urlencode({"car_info": text}).encode()
+    start = time.perf_counter()
+    try:
+        with urlopen(f"{url}/{endpoint}", data=data, timeout=timeout) as response:
+            body = response.read()
+        outcome = "input_error" if ERROR_MARKER in body else "ok"
+    except (URLError, OSError) as error:
+        outcome = type(error).__name__
+    return endpoint, time.perf_counter() - start, outcome
+
+
+def advice_cache_counts(url: str) -> dict:
+    """
+    :param url: base url of the server
+    :return: dictionary of the hit and miss counts of the advice cache, aggregated
+        over the workers
+    """
+    with urlopen(f"{url}/metrics", timeout=10) as response:
+        metrics = response.read().decode()
+    counts = {"hit": 0.0, "miss": 0.0}
+    for result, value in ADVICE_CACHE_METRIC.findall(metrics):
+        counts[result] += float(value)
+    return counts
+
+
+def warm_up(url: str, requests: list, rounds: int, concurrency: int) -> None:
+    """
+    Sends the popular requests before the test so the advice cache holds them
+    :param url: base url of the server
+    :param requests: list of (endpoint, car_info text) of the popular requests
+    :param rounds: number of times each request is sent, so that most workers of a
+        server with a per worker cache receive it
+    :param concurrency: number of concurrent clients
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda request: send(url, *request, 30), requests * rounds))
+
+
+def run_load_test(
+    url: str, requests: list, concurrency: int, timeout: float = 30
+) -> dict:
+    """
+    Sends the requests with a fixed number of concurrent clients
+    :param url: base url of the server
+    :param requests: list of (endpoint, car_info text) from `make_requests`
+    :param concurrency: number of concurrent clients
+    :param timeout: timeout of a single request in seconds
+    :return: report of latency percentiles in milliseconds, throughput and outcomes
+        overall and per endpoint
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(
+            executor.map(lambda request: send(url, *request, timeout), requests)
+        )
+    elapsed = time.perf_counter() - start
+
+    report = {
+        "requests": len(results),
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "throughput": len(results) / elapsed,
+    }
+    groups = {"all": results}
+    for endpoint in sorted({result[0] for result in results}):
+        groups[endpoint] = [result for result in results if result[0] == endpoint]
+    for name, group in groups.items():
+        latencies = np.array([latency for _, latency, _ in group]) * 1000
+        outcomes = {}
+        for _, _, outcome in group:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        report[name] = {
+            "requests": len(group),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p90_ms": float(np.percentile(latencies, 90)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "max_ms": float(latencies.max()),
+            "outcomes": outcomes,
+        }
+    return report
+
+
+def start_server(port: int, workers: int) -> subprocess.Popen:
+    """
+    Starts gunicorn with the production config on this machine and waits until the
+    app reports it is ready
+    :param port: port to bind on 127.0.0.1
+    :param workers: number of gunicorn workers
+    :return: the server process
+    """
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "-c",
+            "gunicorn.conf.py",
+            "--bind",
+            f"127.0.0.1:{port}",
+            "--workers",
+            str(workers),
+            "--access-logfile",
+            "/dev/null",
+            "wsgi:app",
+        ]
+    )
+    for _ in range(600):
+        try:
+            with urlopen(f"http://127.0.0.1:{port}/ready", timeout=1) as response:
+                if response.status == 200:
+                    return server
+        except (URLError, OSError):
+            pass
+        if server.poll() is not None:
+            break
+        time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("The server did not become ready")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument(
+        "--serve", action="store_true", help="start gunicorn on the port of --url"
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--hit-ratio", type=float, default=0.0)
+    parser.add_argument("--hot-set", type=int, default=100)
+    parser.add_argument(
+        "--warm-rounds",
+        type=int,
+        help="times each popular listing is sent before the test, defaults to twice "
+        "the number of workers",
+    )
+    parser.add_argument("--endpoints", default="model1,model2,model3")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args()
+
+    requests, hot = make_requests(
+        args.requests,
+        args.endpoints.split(","),
+        args.hit_ratio,
+        args.hot_set,
+        args.seed,
+    )
+    server = None
+    if args.serve:
+        server = start_server(int(args.url.rsplit(":", 1)[1]), args.workers)
+    try:
+        if args.hit_ratio:
+            warm_up(
+                args.url, hot, args.warm_rounds or 2 * args.workers, args.concurrency
+            )
+        before = advice_cache_counts(args.url)
+        report = run_load_test(args.url, requests, args.concurrency)
+        after = advice_cache_counts(args.url)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print(
+        f"{report['requests']} requests in {report['seconds']:.1f}s,"
+        f" {report['throughput']:.1f} requests/s"
+    )
+    hits, misses = (after[result] - before[result] for result in ["hit", "miss"])
+    report["hit_ratio"] = hits / (hits + misses) if hits + misses else 0.0
+    print(
+        f"Advice cache hit ratio {report['hit_ratio']:.3f},"
+        f" requested {args.hit_ratio:.3f}"
+    )
+    for name, stats in report.items():
+        if isinstance(stats, dict):
+            print(
+                f"{name:8s} p50 {stats['p50_ms']:7.1f}ms  p90 {stats['p90_ms']:7.1f}ms"
+                f"  p99 {stats['p99_ms']:7.1f}ms  max {stats['max_ms']:7.1f}ms"
+                f"  {stats['outcomes']}"
+            )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,198 @@
+"""
+Micro benchmarks of the inference and training hot paths. Run from the root of the
+repository, they only need the committed models and data:
+
+    python -m benchmarks.run_benchmarks --output results.json
+    python -m benchmarks.run_benchmarks --compare results.json
+"""
+import argparse
+import ast
+import json
+import os
+from pathlib import Path
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import available_cars, listings_as_text, synthetic_listings
+from car_purchase_help import fitting, model1, model2, model3
+from car_purchase_help.data_processing import (
+    clean_similar_cars_dict,
+    remove_outliers,
+    remove_outliers_grouped,
+    split_by_description,
+    split_by_description_hash,
+)
+from car_purchase_help.similar_cars import load_similar_cars_index
+from car_purchase_help.utils import clean_input, format_user_input
+
+# Relative slow down of the median above which a benchmark counts as a regression.
+# Timings of single calls vary by 10-20% between runs on the same machine
+REGRESSION_THRESHOLD = 0.25
+
+
+def time_calls(function, args_list: list, repeat: int = 5) -> dict:
+    """
+    Times a function over a list of arguments, repeating the whole list. Assertion
+    errors, which the app reports to the user, are timed like any other call
+    :param function: function to time
+    :param args_list: list of argument tuples, one call each
+    :param repeat: number of passes over the list
+    :return: dictionary of per call timings in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        for args in args_list:
+            start = time.perf_counter()
+            try:
+                function(*args)
+            except AssertionError:
+                pass
+            timings.append(time.perf_counter() - start)
+    timings = np.array(timings)
+    return {
+        "calls": len(timings),
+        "mean": float(timings.mean()),
+        "median": float(np.median(timings)),
+        "p95": float(np.percentile(timings, 95)),
+        "min": float(timings.min()),
+    }
+
+
+def run_benchmarks(n: int = 200, seed: int = 0) -> dict:
+    """
+    :param n: number of synthetic listings used by the per call benchmarks
+    :param seed: random seed of the synthetic listings
+    :return: dictionary of benchmark name to timings
+    """
+    listings = synthetic_listings(n, seed)
+    texts = listings_as_text(listings)
+    rows = list(
+        listings[["manufacturer", "model", "year", "odometer"]].itertuples(
+            index=False, name=None
+        )
+    )
+    cars = [row[:3] for row in rows]
+    # Most cars have no similar cars listed, time model3 on the ones that do
+    index = load_similar_cars_index()
+    similar_cars = [
+        car for car in available_cars() if index.similar_cars(*car) is not None
+    ]
+    similar_rows = list(
+        synthetic_listings(n, seed, similar_cars)[
+            ["manufacturer", "model", "year", "odometer"]
+        ].itertuples(index=False, name=None)
+    )
+    # Every synthetic car has a regression so predict_price never fails
+    predictions = [model1.predict_price(*row) for row in rows]
+    advice_args = [
+        (price, listed_price, residual)
+        for (price, residual), listed_price in zip(predictions, listings["price"])
+    ]
+
+    results = {
+        "format_user_input": time_calls(format_user_input, [(t,) for t in texts]),
+        "clean_input": time_calls(clean_input, rows),
+        "predict_price": time_calls(model1.predict_price, rows),
+        "predict_mileage_cost": time_calls(model2.predict_mileage_cost, cars),
+        "get_similar_advice": time_calls(model3.get_similar_advice, similar_rows),
+        "get_advice": time_calls(model1.get_advice, advice_args),
+    }
+
+    # Batch paths, one call over a larger synthetic set
+    large = synthetic_listings(n * 500, seed)
+    results["predict_prices_batch"] = time_calls(model1.predict_prices, [(large,)], 3)
+    results["remove_outliers"] = time_calls(remove_outliers, [(large,)], 3)
+    results["remove_outliers_grouped"] = time_calls(
+        remove_outliers_grouped, [(large, ["manufacturer", "model", "year"])], 3
+    )
+    results["split_by_description"] = time_calls(split_by_description, [(large,)], 3)
+    results["split_by_description_hash"] = time_calls(
+        split_by_description_hash, [(large,)], 3
+    )
+    results["fit_grouped_regressions"] = time_calls(
+        fitting.fit_grouped_regressions, [(large,)], 3
+    )
+
+    # fit_lin_regression saves to ../models so run it from a scratch directory
+    with open("data/similar_cars.txt", "r") as f:
+        scraped_similar_cars = ast.literal_eval(f.read())
+    results["clean_similar_cars_dict"] = time_calls(
+        clean_similar_cars_dict, [(scraped_similar_cars, large)], 1
+    )
+    fit_cars = sorted(set(cars))[:20]
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        (Path(scratch) / "models").mkdir()
+        (Path(scratch) / "work").mkdir()
+        os.chdir(Path(scratch) / "work")
+        try:
+            results["fit_lin_regression"] = time_calls(
+                fitting.fit_lin_regression, [(large,) + car for car in fit_cars], 1
+            )
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def compare(results: dict, baseline: dict) -> list:
+    """
+    :param results: benchmark results of this run
+    :param baseline: benchmark results of an earlier run
+    :return: list of (name, baseline median, median, relative change) of the
+        benchmarks present in both runs
+    """
+    rows = []
+    for name, timings in results.items():
+        if name in baseline:
+            before = baseline[name]["median"]
+            rows.append(
+                (name, before, timings["median"], timings["median"] / before - 1)
+            )
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--n", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.n, args.seed)
+    for name, timings in results.items():
+        print(f"{name:28s} median {timings['median'] * 1e6:12.1f} us")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "time": time.time(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)["results"]
+        regressions = 0
+        print(
+            f"\n{'benchmark':28s} {'before us':>12s} {'after us':>12s} {'change':>8s}"
+        )
+        for name, before, after, change in compare(results, baseline):
+            flag = " REGRESSION" if change > args.threshold else ""
+            regressions += bool(flag)
+            print(
+                f"{name:28s} {before * 1e6:12.1f} {after * 1e6:12.1f}"
+                f" {change:+8.1%}{flag}"
+            )
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+from car_purchase_help.catalog import load_catalog
+from car_purchase_help.model1 import gather_coefficients
+
+
+def available_cars() -> list:
+    """
+    :return: sorted list of the (manufacturer, model, year) which have a regression
+    """
+    catalog = load_catalog()
+    return [
+        (manufacturer, model, year)
+        for (manufacturer, model), years in sorted(catalog.years.items())
+        for year in years
+    ]
+
+
+def synthetic_listings(n: int, seed: int = 0, cars: list = None) -> pd.DataFrame:
+    """
+    Generates Craigslist-like listings for the cars which have a regression. The
+    price follows the car's regression plus noise of the size of its mean absolute
+    residual, so the listings exercise every deal category
+    :param n: number of listings
+    :param seed: random seed
+    :param cars: list of (manufacturer, model, year) to draw from, defaults to
+        every car with a regression
+    :return: dataframe with the columns of the formatted Craigslist data used by the
+        models: manufacturer, model, year, odometer, price and description
+    """
+    rng = np.random.default_rng(seed)
+    cars = cars or available_cars()
+    chosen = rng.integers(0, len(cars), n)
+    manufacturers = np.array([cars[i][0] for i in chosen])
+    models = np.array([cars[i][1] for i in chosen])
+    years = np.array([cars[i][2] for i in chosen])
+    odometers = rng.integers(1001, 250000, n)
+
+    keys = np.char.add(
+        np.char.add(np.char.add(manufacturers, "_"), np.char.add(models, "_")),
+        years.astype(str),
+    )
+    coefficients = gather_coefficients(keys)
+    prices = coefficients[:, 0] + coefficients[:, 1] * odometers
+    prices += rng.normal(0, 1, n) * coefficients[:, 2] * 1.25
+    prices = np.maximum(prices, 500).round()
+
+    return pd.DataFrame(
+        {
+            "manufacturer": manufacturers,
+            "model": models,
+            "year": years,
+            "odometer": odometers,
+            "price": prices.astype(int),
+            # Dealers reuse descriptions, so roughly three listings share each one
+            "description": rng.integers(0, max(1, n // 3), n).astype(str),
+        }
+    )
+
+
+def listings_as_text(listings: pd.DataFrame) -> list:
+    """
+    :param listings: dataframe from `synthetic_listings`
+    :return: list of the `manufacturer, model, year, mileage, listed price` strings
+        typed into the web app
+    """
+    return [
+        f"{row.manufacturer}, {row.model}, {row.year}, {row.odometer}, {row.price}"
+        for row in listings.itertuples()
+    ]
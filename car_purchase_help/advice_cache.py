@@ -0,0 +1,147 @@
+from collections import OrderedDict
+import os
+import sqlite3
+import threading
+import time
+
+from car_purchase_help import constants
+
+
+def normalize_key(car: tuple, model_page: str, version: str = None) -> str:
+    """
+    Builds the cache key from the cleaned input so that spacing and case of the user
+    input do not matter
+    :param car: tuple returned by `clean_user_input`
+    :param model_page: which model to use
+    :param version: version of the models, so advice from older ones is not reused
+    :return: key of the form
+        `version|model_page|manufacturer|model|year|odometer|listed_price`
+    """
+    return "|".join([str(version), model_page] + [str(value) for value in car])
+
+
+class MemoryCache:
+    """
+    Least recently used cache with expiry, local to the process
+    """
+
+    def __init__(
+        self,
+        max_entries: int = constants.ADVICE_CACHE_SIZE,
+        ttl: float = constants.ADVICE_CACHE_TTL,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str):
+        """
+        :return: the cached value or None if it is missing or expired
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self.lock:
+            self.entries[key] = (value, time.time() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+class SQLiteCache:
+    """
+    Least recently used cache with expiry in a local SQLite file. Every process and
+    thread opens its own connection to the file so gunicorn workers share entries,
+    and they survive restarts
+    """
+
+    def __init__(
+        self,
+        path: str = constants.ADVICE_CACHE_PATH,
+        max_entries: int = constants.ADVICE_CACHE_SIZE,
+        ttl: float = constants.ADVICE_CACHE_TTL,
+    ) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.local = threading.local()
+        with self.connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS advice ("
+                "key TEXT PRIMARY KEY, value TEXT, expires REAL, accessed REAL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS advice_accessed ON advice (accessed)"
+            )
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        :return: the connection of the current thread, reopened after a fork
+        """
+        if getattr(self.local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def get(self, key: str):
+        """
+        :return: the cached value or None if it is missing or expired
+        """
+        now = time.time()
+        with self.connection() as connection:
+            row = connection.execute(
+                "SELECT value FROM advice WHERE key = ? AND expires >= ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE advice SET accessed = ? WHERE key = ?", (now, key)
+            )
+        return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self.connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO advice VALUES (?, ?, ?, ?)",
+                (key, value, now + self.ttl, now),
+            )
+            # Remove expired entries then the least recently used over the limit
+            connection.execute("DELETE FROM advice WHERE expires < ?", (now,))
+            connection.execute(
+                "DELETE FROM advice WHERE key IN (SELECT key FROM advice "
+                "ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self) -> None:
+        with self.connection() as connection:
+            connection.execute("DELETE FROM advice")
+
+
+def make_advice_cache(backend: str = constants.ADVICE_CACHE_BACKEND):
+    """
+    :param backend: "memory" or "sqlite"
+    :return: the advice cache configured in constants
+    """
+    assert backend in ["memory", "sqlite"], "Advice cache backend is memory or sqlite"
+    if backend == "sqlite":
+        return SQLiteCache()
+    return MemoryCache()
@@ -0,0 +1,174 @@
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+from car_purchase_help import constants
+from car_purchase_help.model_store import load_model_store, INTERCEPT
+
+
+class PrefixTrie:
+    """
+    Trie mapping strings to values, used for autocomplete. Any sequence of non empty
+    strings can be inserted, so it also works as a trie of words
+    """
+
+    def __init__(self) -> None:
+        self.root = {}
+
+    def insert(self, text: str, value) -> None:
+        node = self.root
+        for character in text:
+            node = node.setdefault(character, {})
+        # The empty string can not be a character so it marks the end of a word
+        node[""] = value
+
+    def longest_prefix(self, sequence) -> (int, object):
+        """
+        :param sequence: string, or sequence of words, to match the start of
+        :return: length of the longest inserted sequence which starts `sequence` and
+            its value, or 0 and None if there is none
+        """
+        node = self.root
+        length, value = 0, None
+        for i, character in enumerate(sequence):
+            node = node.get(character)
+            if node is None:
+                break
+            if "" in node:
+                length, value = i + 1, node[""]
+        return length, value
+
+    def complete(self, prefix: str, limit: int = constants.SUGGEST_LIMIT) -> list:
+        """
+        :param prefix: start of the strings to find
+        :param limit: maximum number of values returned
+        :return: values of the strings starting with the prefix in alphabetical order
+        """
+        node = self.root
+        for character in prefix:
+            node = node.get(character)
+            if node is None:
+                return []
+
+        values = []
+        stack = [node]
+        while stack and len(values) < limit:
+            node = stack.pop()
+            if "" in node:
+                values.append(node[""])
+            # Push in reverse so the alphabetically first child is visited first
+            for character in sorted((c for c in node if c), reverse=True):
+                stack.append(node[character])
+        return values
+
+
+class Catalog:
+    """
+    Index of the manufacturer, model and year combinations which have a regression
+    """
+
+    def __init__(self, keys) -> None:
+        """
+        Constructor
+        :param keys: iterable of `manufacturer_model_year` keys of the regressions
+        """
+        years = defaultdict(set)
+        for key in keys:
+            manufacturer, model_year = str(key).split("_", 1)
+            model, year = model_year.rsplit("_", 1)
+            years[(manufacturer, model)].add(int(year))
+
+        self.years = {car: sorted(car_years) for car, car_years in years.items()}
+        self.manufacturers = frozenset(manufacturer for manufacturer, _ in self.years)
+        self.trie = PrefixTrie()
+        for manufacturer, model in sorted(self.years):
+            self.trie.insert(f"{manufacturer} {model}", (manufacturer, model))
+
+    @classmethod
+    def from_store(cls, store) -> "Catalog":
+        """
+        :param store: a ModelStore
+        :return: catalog of the regressions fitted in the store
+        """
+        fitted = ~np.isnan(store.coefficients[:, INTERCEPT])
+        return cls(store.keys[fitted])
+
+    def __len__(self) -> int:
+        return sum(len(car_years) for car_years in self.years.values())
+
+    def __contains__(self, car) -> bool:
+        manufacturer, model, year = car
+        return year in self.years.get((manufacturer, model), ())
+
+    def get_years(self, manufacturer: str, model: str) -> list:
+        """
+        :return: sorted years which have a regression for the car
+        """
+        return self.years.get((manufacturer, model), [])
+
+    def validate(self, manufacturer: str, model: str, year: int) -> None:
+        """
+        Checks that there is a regression for the car without touching the filesystem
+        :param manufacturer: cleaned manufacturer of the vehicle
+        :param model: cleaned model of the vehicle
+        :param year: year of manufacture
+        """
+        assert (
+            manufacturer in self.manufacturers
+        ), "No regression models for this manufacturer"
+        car_years = self.get_years(manufacturer, model)
+        assert car_years, "No regression models for this model"
+        assert year in car_years, (
+            "No regression model for this car from that year. Years available: "
+            + ", ".join(str(car_year) for car_year in car_years)
+        )
+
+    def suggest(self, text: str, limit: int = constants.SUGGEST_LIMIT) -> list:
+        """
+        Autocompletes the manufacturer and model
+        :param text: start of `manufacturer model` as typed by the user
+        :param limit: maximum number of suggestions
+        :return: list of dictionaries of manufacturer, model and years available
+        """
+        prefix = " ".join(text.replace(",", " ").lower().split())
+        return [
+            {
+                "manufacturer": manufacturer,
+                "model": model,
+                "years": self.years[(manufacturer, model)],
+            }
+            for manufacturer, model in self.trie.complete(prefix, limit)
+        ]
+
+
+_catalogs = {}
+
+
+def load_catalog(
+    store_dir: str = constants.MODEL_STORE_DIR, models_dir: str = constants.MODELS_DIR
+) -> Catalog:
+    """
+    Builds the catalog once per process from the keys of the model store, or from
+    the pkl file names if the store has not been built
+    :param store_dir: directory of the model store
+    :param models_dir: directory containing the pkl files
+    :return: the Catalog
+    """
+    if store_dir not in _catalogs:
+        store = load_model_store(store_dir)
+        if store is not None:
+            _catalogs[store_dir] = Catalog.from_store(store)
+        else:
+            keys = [model_file.stem for model_file in Path(models_dir).glob("*.pkl")]
+            _catalogs[store_dir] = Catalog(keys)
+    return _catalogs[store_dir]
+
+
+def replace_catalog(store_dir: str, catalog: Catalog) -> None:
+    """
+    Serves `catalog` from now on in place of the one built by `load_catalog`
+    :param store_dir: directory of the model store
+    :param catalog: the Catalog of the new version of the store
+    """
+    _catalogs[store_dir] = catalog
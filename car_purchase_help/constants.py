@@ -49,4 +49,55 @@ MANUFACTURERS = [
     "hennessey",
 ]
 YEARS = [x for x in range(1981, 2019)]
+# Sets for constant time membership checks of the user input
+MANUFACTURER_SET = frozenset(MANUFACTURERS)
+YEAR_SET = frozenset(YEARS)
 MILEAGE_DECREASE_PERIOD = 10000
+MODELS_DIR = "models"
+MODEL_STORE_DIR = "models/store"
+# Published versions of the model store kept on disk
+MODEL_STORE_KEEP_VERSIONS = 3
+# Reports of `evaluation` on the held out listings, one per store version
+EVALUATION_DIR = "models/evaluation"
+# Environment variable holding the token of the admin endpoints, which are
+# disabled when it is not set
+ADMIN_TOKEN_ENV = "CAR_HELP_ADMIN_TOKEN"
+# Subdirectory of the models directory holding the CompactRegression pickles
+COMPACT_MODELS_SUBDIR = "compact"
+# Quantiles of the training residuals kept by a CompactRegression
+RESIDUAL_QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+REGISTRY_MAX_ENTRIES = 512
+# Manufacturers whose regressions are loaded when the app starts. Use "all" to
+# load every regression, an empty list disables preloading
+REGISTRY_PRELOAD = []
+API_MAX_LISTINGS = 500
+API_CACHE_MAX_AGE = 3600
+VEHICLES_CSV = "data/vehicles.csv"
+VEHICLES_CACHE_DIR = "data/vehicles_cache"
+INGEST_CHUNKSIZE = 200000
+SIMILAR_CARS_PATH = "data/clean_similar_cars.txt"
+SIMILAR_CARS_INDEX_PATH = "data/similar_cars_index.npz"
+# Advice cache of the web app. The backend is "memory" for a cache per process or
+# "sqlite" for a cache in ADVICE_CACHE_PATH shared by every worker and kept across
+# restarts
+ADVICE_CACHE_BACKEND = "memory"
+ADVICE_CACHE_SIZE = 1024
+ADVICE_CACHE_TTL = 24 * 60 * 60
+ADVICE_CACHE_PATH = "advice_cache.sqlite3"
+SUGGEST_LIMIT = 10
+# Regression plots rendered on demand by the web app. Matplotlib is not thread safe
+# so each process renders one plot at a time unless PLOT_WORKERS is raised
+PLOT_CACHE_DIR = "models/plot_cache"
+PLOT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+PLOT_WORKERS = 1
+PLOT_TIMEOUT = 30
+PLOT_CACHE_MAX_AGE = 24 * 60 * 60
+SCORE_CHUNKSIZE = 100000
+# Profiling of the web app. PROFILE_RATE is the fraction of the requests profiled,
+# 0 disables sampling, and can be overridden by the PROFILE_RATE_ENV environment
+# variable. Admins can also profile a request with the `X-Profile: 1` header
+PROFILE_RATE = 0.0
+PROFILE_RATE_ENV = "CAR_HELP_PROFILE_RATE"
+PROFILE_DIR = "profiles"
+PROFILE_SLOW_SECONDS = 0.5
+PROFILE_DUMP_EVERY = 100
@@ -1,41 +1,131 @@
 from car_purchase_help import constants
 
-from sklearn.model_selection import train_test_split, GroupShuffleSplit
+import numpy as np
 import pandas as pd
 from collections import defaultdict
+import re
 
 
-def format_raw_df(df: pd.DataFrame) -> pd.DataFrame:
+# Low cardinality string columns of the Craigslist data kept as categoricals
+CATEGORICAL_COLUMNS = [
+    "region",
+    "manufacturer",
+    "model",
+    "condition",
+    "cylinders",
+    "fuel",
+    "title_status",
+    "transmission",
+    "drive",
+    "size",
+    "type",
+    "paint_color",
+    "state",
+]
+INTEGER_COLUMNS = ["year", "odometer", "price"]
+FLOAT_COLUMNS = ["lat", "long"]
+
+
+def format_raw_df(df: pd.DataFrame, lean: bool = True) -> pd.DataFrame:
     """
     Cleanup data
     :param df: raw DataFrame
+    :param lean: store the string columns as categoricals and downcast the numerical
+        columns with `shrink_dtypes`
     :return: processed DataFrame
     """
     # Dropping the county column as it is completely missing
-    df = df.drop(["county"], axis=1)
+    df = df.drop(["county"], axis=1, errors="ignore")
 
     # Setting types and fill NAs
-    df["id"].fillna(-1, inplace=True)
-    df["id"] = df["id"].astype(int)
-    df["year"].fillna(-1, inplace=True)
-    df["year"] = df["year"].astype(int)
-    df["odometer"].fillna(-1, inplace=True)
-    df["odometer"] = df["odometer"].astype(int)
-    df["description"].fillna("", inplace=True)
-    df["lat"].fillna(-1, inplace=True)
-    df["long"].fillna(-1, inplace=True)
+    df = df.fillna(
+        {"id": -1, "year": -1, "odometer": -1, "description": "", "lat": -1, "long": -1}
+    )
+    df = df.astype({"id": int, "year": int, "odometer": int})
 
     # Use the provided ID as the index
-    df.set_index("id", inplace=True, drop=True)
+    df = df.set_index("id", drop=True)
 
     # Limiting the range of the numerical columns to remove clear outliers
-    df = df[(df["year"] > 1980) & (df["year"] < 2020)]
-    df = df[(df["odometer"] > 1000) & (df["odometer"] < 300000)]
-    df = df[df["price"] >= 500]
+    df = df[
+        (df["year"] > 1980)
+        & (df["year"] < 2020)
+        & (df["odometer"] > 1000)
+        & (df["odometer"] < 300000)
+        & (df["price"] >= 500)
+    ]
+
+    if lean:
+        df = shrink_dtypes(df)
+    return df
 
+
+def shrink_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts the CATEGORICAL_COLUMNS to categoricals and downcasts the INTEGER_COLUMNS
+    to the smallest integer type holding their values and the FLOAT_COLUMNS to 32 bit
+    floats. Columns missing from the dataframe are skipped
+    :param df: dataframe as returned by `format_raw_df`
+    :return: dataframe with the smaller types
+    """
+    dtypes = {
+        column: "category"
+        for column in CATEGORICAL_COLUMNS
+        if column in df.columns
+        and not isinstance(df[column].dtype, pd.CategoricalDtype)
+    }
+    dtypes.update(
+        {column: np.float32 for column in FLOAT_COLUMNS if column in df.columns}
+    )
+    df = df.astype(dtypes)
+    for column in INTEGER_COLUMNS:
+        if column in df.columns:
+            # Left as they are if they hold missing or fractional values
+            df[column] = pd.to_numeric(df[column], downcast="integer")
     return df
 
 
+def drop_description(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    The description is by far the largest column and is only needed to split the
+    data, drop it once the split is done
+    :param df: formatted dataframe
+    :return: the dataframe without the description
+    """
+    return df.drop(columns=["description"], errors="ignore")
+
+
+def concat_frames(frames: list) -> pd.DataFrame:
+    """
+    Concatenates dataframes keeping their categorical columns categorical, which
+    pandas only does when the categories of every frame are the same
+    :param frames: list of dataframes with the same columns
+    :return: the concatenated dataframe
+    """
+    frames = list(frames)
+    for column in frames[0].columns:
+        dtypes = [frame[column].dtype for frame in frames]
+        if all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes):
+            categories = pd.api.types.union_categoricals(
+                [frame[column] for frame in frames]
+            ).categories
+            frames = [
+                frame.assign(**{column: frame[column].cat.set_categories(categories)})
+                for frame in frames
+            ]
+    return pd.concat(frames)
+
+
+def memory_footprint(df: pd.DataFrame) -> pd.Series:
+    """
+    :param df: a dataframe
+    :return: bytes held by each column, including the strings, and in total
+    """
+    usage = df.memory_usage(deep=True)
+    usage["total"] = usage.sum()
+    return usage
+
+
 def split_by_description(
     formatted_df: pd.DataFrame,
     description_column: str = "description",
@@ -50,6 +140,7 @@ def split_by_description(
     training set to test set.
     :param formatted_df: dataframe that has already been passed through the formatter
     """
+    from sklearn.model_selection import GroupShuffleSplit
 
     splitter = GroupShuffleSplit(
         n_splits=1, test_size=test_size, random_state=random_state
@@ -59,6 +150,47 @@ def split_by_description(
     return formatted_df.iloc[train_idx, :], formatted_df.iloc[test_idx, :]
 
 
+def description_test_mask(
+    descriptions: pd.Series,
+    test_size: float = constants.TEST_PROPORTION,
+    random_state: int = constants.RANDOM_STATE,
+) -> np.ndarray:
+    """
+    Assigns rows to the test set from a hash of their description. The hash is
+    deterministic, so rows with the same description land in the same set whichever
+    chunk of the data they are in, and no global shuffle is needed
+    :param descriptions: the description of every row
+    :param test_size: proportion of the descriptions assigned to the test set
+    :param random_state: salt of the hash, a different value gives a different split
+    :return: boolean array, True for the rows of the test set
+    """
+    hashes = pd.util.hash_pandas_object(
+        descriptions.fillna(""), index=False, hash_key=f"{random_state:016d}"[-16:],
+    ).values
+    # The hashes are uniform over the 64 bit range
+    return hashes < np.uint64(test_size * 2 ** 64)
+
+
+def split_by_description_hash(
+    formatted_df: pd.DataFrame,
+    description_column: str = "description",
+    test_size: float = constants.TEST_PROPORTION,
+    random_state: int = constants.RANDOM_STATE,
+) -> (pd.DataFrame, pd.DataFrame):
+    """
+    Streaming version of `split_by_description`. Rows with the same description are
+    kept together in the training or test set using `description_test_mask`, so the
+    split can be applied to each chunk of the data separately and gives the same
+    result as applying it to the whole dataframe
+    :param formatted_df: dataframe that has already been passed through the formatter
+    :return: the training set and the test set
+    """
+    test = description_test_mask(
+        formatted_df[description_column], test_size, random_state
+    )
+    return formatted_df[~test], formatted_df[test]
+
+
 def remove_outliers(df: pd.DataFrame, column: str = "price", mode: str = "IQR"):
     """
     Removes outliers from the provided column of the dataframe. Outliers
@@ -81,52 +213,148 @@ def remove_outliers(df: pd.DataFrame, column: str = "price", mode: str = "IQR"):
         return df[(df[column] < Q3 + 1.5 * IQR) & (df[column] > Q1 - 1.5 * IQR)]
 
 
-def find_manufacturer(car_text: str, manufacturer_list: list):
+def remove_outliers_grouped(
+    df: pd.DataFrame, group_columns: list, column: str = "price", mode: str = "IQR",
+) -> pd.DataFrame:
+    """
+    Applies `remove_outliers` to every group of the dataframe at once. The bounds of
+    every group are computed with a single groupby transform rather than one slice
+    of the dataframe at a time
+    :param df: dataframe assumed to be clean and formatted
+    :param group_columns: columns defining the groups, usually manufacturer, model, year
+    :param column: column to remove the outliers from. Usually this will be price
+    :param mode: IQR for outside 1.5 IQR or SD for outside 3 standard deviations
+    :return: the same dataframe with rows removed which contain an outlier for their group
+    """
+    mode = mode.upper()
+    assert mode in ["IQR", "SD"], (
+        "mode is either IQR for outside 1.5 IQR method"
+        " or SD for outside 3 standard deviations from the mean method"
+    )
+    grouped = df.groupby(group_columns, observed=True)[column]
+    if mode == "SD":
+        mean = grouped.transform("mean")
+        std = grouped.transform("std")
+        return df[((df[column] - mean) / std).abs() < 3]
+    else:
+        Q3 = grouped.transform("quantile", 0.75)
+        Q1 = grouped.transform("quantile", 0.25)
+        IQR = Q3 - Q1
+        return df[(df[column] < Q3 + 1.5 * IQR) & (df[column] > Q1 - 1.5 * IQR)]
+
+
+def split_car_text(car_text: str) -> tuple:
+    """
+    :param car_text: make and model text where words are separated by hyphens or spaces
+    :return: tuple of the words
+    """
+    return tuple(word for word in re.split("[- ]", car_text.strip()) if word)
+
+
+def find_manufacturer(car_text: str, manufacturer_list):
     """
     :param car_text: string of car make and model information of the form `make-model` where
         make may contain hyphes or spaces.
-    :param manfucaturer_list: list containing the manufacturers to check
+    :param manfucaturer_list: collection containing the manufacturers to check, a set
+        makes every check constant time
     :return: if the car has manufacturer in the list then returns the 
         manufacturer, else returns None
     """
     split = car_text.split("-")
-    possible_manufacturer_space = split[0]
-    possible_manufacturer_hyphen = split[0]
-    for chunk in split[1:]:
+    # At least the last chunk is left for the model
+    for end in range(1, len(split)):
+        possible_manufacturer_space = " ".join(split[:end])
         if possible_manufacturer_space in manufacturer_list:
             return possible_manufacturer_space
+        possible_manufacturer_hyphen = "-".join(split[:end])
         if possible_manufacturer_hyphen in manufacturer_list:
             return possible_manufacturer_hyphen
-        possible_manufacturer_space = (
-            possible_manufacturer_space + " " + possible_manufacturer_space
-        )
-        possible_manufacturer_hyphen = (
-            possible_manufacturer_hyphen + "-" + possible_manufacturer_hyphen
-        )
     return None
 
 
-def find_model(car_text: str, model_list: list):
+def find_model(car_text: str, model_list):
     """
     :param car_text: string of car make and model information of the form `make-model` where
         make may contain hyphes or spaces.
-    :param model_list: list containing all the models in the Craiglist dataset
+    :param model_list: collection containing all the models in the Craiglist dataset, a
+        set makes every check constant time
     :return: if the model is in the list return it's text
         properly formatted, else return None
     """
     split = car_text.split("-")
-    possible_model_space = split[-1]
-    possible_model_hyphen = split[-1]
-    for chunk in split[-2::-1]:
+    # At least the first chunk is left for the manufacturer
+    for start in range(len(split) - 1, 0, -1):
+        possible_model_space = " ".join(split[start:])
         if possible_model_space in model_list:
             return possible_model_space
+        possible_model_hyphen = "-".join(split[start:])
         if possible_model_hyphen in model_list:
             return possible_model_hyphen
-        possible_model_hyphen = chunk + " " + possible_model_hyphen
-        possible_model_hyphen = chunk + "-" + possible_model_hyphen
     return None
 
 
+class NameResolver:
+    """
+    Resolves scraped `make-model` strings, where both the make and the model may
+    contain hyphens or spaces, to the manufacturer and model names of the Craigslist
+    data. The manufacturer is the longest run of leading words found in a trie of the
+    known manufacturers. The model is the longest run of the words that follow, ending
+    the string, that is a known model of that manufacturer, looked up in a hash map
+    """
+
+    def __init__(self, cars) -> None:
+        """
+        Constructor
+        :param cars: iterable of the known (manufacturer, model) pairs
+        """
+        # Imported here as the catalog is part of the serving code
+        from car_purchase_help.catalog import PrefixTrie
+
+        self.manufacturers = PrefixTrie()
+        self.models = defaultdict(dict)
+        # Sorted so that `c class` is preferred over `c-class` when both exist
+        for manufacturer, model in sorted(set(cars)):
+            self.manufacturers.insert(split_car_text(manufacturer), manufacturer)
+            self.models[manufacturer].setdefault(split_car_text(model), model)
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame) -> "NameResolver":
+        """
+        :param df: the dataframe of Craiglist data
+        :return: resolver of the manufacturers and models present in the dataframe
+        """
+        cars = df[["manufacturer", "model"]].dropna().drop_duplicates()
+        return cls(zip(cars["manufacturer"].values, cars["model"].values))
+
+    def resolve(self, car_text: str) -> (str, str):
+        """
+        :param car_text: string of the form `make-model`
+        :return: tuple of the manufacturer and model, or None if either is unknown
+        """
+        words = split_car_text(car_text)
+        length, manufacturer = self.manufacturers.longest_prefix(words)
+        if manufacturer is None:
+            return None
+        models = self.models[manufacturer]
+        for start in range(length, len(words)):
+            model = models.get(words[start:])
+            if model is not None:
+                return manufacturer, model
+        return None
+
+    def resolve_many(self, car_texts) -> dict:
+        """
+        Resolves a batch of strings, each distinct string only once
+        :param car_texts: iterable of strings of the form `make-model`
+        :return: dictionary of each string to the result of `resolve`
+        """
+        resolved = {}
+        for car_text in car_texts:
+            if car_text not in resolved:
+                resolved[car_text] = self.resolve(car_text)
+        return resolved
+
+
 def clean_similar_cars_dict(similar_cars: dict, df: pd.DataFrame):
     """
     Takes the dictionary of similar cars and from the list of similar cars removes
@@ -139,17 +367,39 @@ def clean_similar_cars_dict(similar_cars: dict, df: pd.DataFrame):
     :return: dictionary of similar cars where the only car in the value lists are actually
         present in the original dataframe. And the names are formatted as `make,model`
     """
-    manufacturer_list = df["manufacturer"].unique()
-    model_list = df["model"].unique()
+    resolver = NameResolver.from_dataframe(df)
+    resolved = resolver.resolve_many(
+        car for similar_set in similar_cars.values() for car in similar_set
+    )
     similar_cars_clean = defaultdict(set)
-    print(type(similar_cars))
     for key, similar_set in similar_cars.items():
         for car in similar_set:
-            manufacturer = find_manufacturer(car, manufacturer_list)
-            if manufacturer:
-                model = find_model(car, model_list)
-                if model:
-                    similar_cars_clean[key.replace(",", "_")].add(
-                        manufacturer + "_" + model
-                    )
+            if resolved[car] is not None:
+                manufacturer, model = resolved[car]
+                similar_cars_clean[key.replace(",", "_")].add(
+                    manufacturer + "_" + model
+                )
     return dict(similar_cars_clean)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Report the memory footprint of the formatted Craigslist data"
+    )
+    parser.add_argument("csv", nargs="?", default=constants.VEHICLES_CSV)
+    args = parser.parse_args()
+
+    raw_df = pd.read_csv(args.csv)
+    formatted_df = format_raw_df(raw_df, lean=False)
+    lean_df = format_raw_df(raw_df)
+    report = pd.DataFrame(
+        {
+            "formatted": memory_footprint(formatted_df),
+            "lean": memory_footprint(lean_df),
+            "lean without description": memory_footprint(drop_description(lean_df)),
+        }
+    )
+    print(f"Raw csv: {memory_footprint(raw_df)['total'] / 2 ** 20:.1f} MiB")
+    print((report / 2 ** 20).round(2).to_string(float_format="%.2f"))
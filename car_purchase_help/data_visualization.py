@@ -26,6 +26,41 @@ def save_lin_reg_plot(
     :param y_preds: predicitons for the odometer values from the regression
     """
     fig, ax = plt.subplots(figsize=(8, 6), dpi=100)
+    draw_lin_reg_plot(ax, manufacturer, model, year, X, y, y_preds)
+    file_name = f"../models/images/{manufacturer}_{model}_{year}.png"
+    fig.savefig(file_name, bbox_inches="tight")
+
+    # Attempt to properly close the figure and garbage collect as memory usage accumulating
+    # as all the models are trained
+    plt.close("all")
+    gc.collect()
+
+
+def draw_lin_reg_plot(
+    ax,
+    manufacturer: str,
+    model: str,
+    year: int,
+    X: np.array,
+    y: np.array,
+    y_preds: np.array,
+    mean_absolute_residual: float = None,
+) -> None:
+    """
+    Draws the scatter plot of the data, linear regression line and boundaries for
+    the different deal levels onto the axes
+    :param ax: matplotlib axes to draw on
+    :param manufacturer: manufacturer of the vechicle
+    :param model: model of the vehicle
+    :param year: year of manufacture
+    :param X: array of odometer values for the plot
+    :param y: array of price values for the plot
+    :param y_preds: predicitons for the sorted odometer values from the regression
+    :param mean_absolute_residual: mean absolute residual the deal boundaries are
+        drawn from, defaults to the one of the predictions for the plotted data
+    """
+    if mean_absolute_residual is None:
+        mean_absolute_residual = np.mean(abs(y_preds - y))
     ax.set_title(f"{manufacturer}, {model} from {year}")
     ax.set_xlabel("Mileage")
     ax.set_ylabel("Price")
@@ -36,7 +71,7 @@ def save_lin_reg_plot(
     # by the mean absolute residual of the regression
     ax.plot(
         np.sort(X, axis=0),
-        y_preds - constants.RESIDUAL_FACTOR_DIFF * np.mean(abs(y_preds - y)),
+        y_preds - constants.RESIDUAL_FACTOR_DIFF * mean_absolute_residual,
         label="Good deal",
         ls="--",
         lw=0.7,
@@ -44,7 +79,7 @@ def save_lin_reg_plot(
     )
     ax.plot(
         np.sort(X, axis=0),
-        y_preds - 2 * constants.RESIDUAL_FACTOR_DIFF * np.mean(abs(y_preds - y)),
+        y_preds - 2 * constants.RESIDUAL_FACTOR_DIFF * mean_absolute_residual,
         label="Very good deal",
         ls="--",
         lw=0.7,
@@ -52,7 +87,7 @@ def save_lin_reg_plot(
     )
     ax.plot(
         np.sort(X, axis=0),
-        y_preds + constants.RESIDUAL_FACTOR_DIFF * np.mean(abs(y_preds - y)),
+        y_preds + constants.RESIDUAL_FACTOR_DIFF * mean_absolute_residual,
         label="Bad deal",
         ls="--",
         lw=0.7,
@@ -60,17 +95,10 @@ def save_lin_reg_plot(
     )
     ax.plot(
         np.sort(X, axis=0),
-        y_preds + 2 * constants.RESIDUAL_FACTOR_DIFF * np.mean(abs(y_preds - y)),
+        y_preds + 2 * constants.RESIDUAL_FACTOR_DIFF * mean_absolute_residual,
         label="Very bad deal",
         ls="--",
         lw=0.7,
         c="darkred",
     )
     ax.legend()
-    file_name = f"../models/images/{manufacturer}_{model}_{year}.png"
-    fig.savefig(file_name, bbox_inches="tight")
-
-    # Attempt to properly close the figure and garbage collect as memory usage accumulating
-    # as all the models are trained
-    plt.close("all")
-    gc.collect()
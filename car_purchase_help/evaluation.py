@@ -0,0 +1,228 @@
+import argparse
+import json
+from pathlib import Path
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from car_purchase_help import constants
+from car_purchase_help.data_processing import format_raw_df, split_by_description_hash
+from car_purchase_help.ingest import load_cache
+from car_purchase_help.fitting import prepare_training_frame, training_keys
+from car_purchase_help.model1 import DEAL_CATEGORIES, get_deal_categories
+from car_purchase_help.model_store import (
+    current_version,
+    publish_model_store,
+    read_model_store,
+    CANDIDATE_DIR,
+    INTERCEPT,
+    MEAN_ABSOLUTE_RESIDUAL,
+    SLOPE,
+)
+
+# Share of the held out listings falling in each deal category of `get_advice`
+SHARE_COLUMNS = [f"share_{category.replace(' ', '_')}" for category in DEAL_CATEGORIES]
+REPORT_COLUMNS = [
+    "n",
+    "mae",
+    "bias",
+    "mean_absolute_residual",
+    "coverage",
+] + SHARE_COLUMNS
+
+
+def evaluate_regressions(
+    data: pd.DataFrame, keys: np.ndarray, coefficients: np.ndarray
+) -> (pd.DataFrame, dict):
+    """
+    Evaluates every regression on the held out listings in one pass, joining the
+    listings to the coefficients by key rather than predicting them one at a time
+    :param data: held out dataframe (assumed to be clean and formatted)
+    :param keys: sorted keys of the regressions, as written to the model store
+    :param coefficients: array of shape (len(keys), 3) of intercept, slope and mean
+        absolute residual in the same order as the keys
+    :return: tuple of the report, a dataframe indexed by key with the REPORT_COLUMNS,
+        and a dictionary of the same metrics over every listing with a regression.
+        `bias` is the mean of the predicted minus the listed price and `coverage` the
+        share of listings within the good to bad deal bands, ie whose price is at
+        most 2 RESIDUAL_FACTOR_DIFFs of mean absolute residual from the prediction
+    """
+    data = prepare_training_frame(data)
+    row_keys = training_keys(data).values.astype(str)
+
+    # Join the listings to the store by binary search of its sorted keys
+    keys = np.asarray(keys, dtype=str)
+    coefficients = np.asarray(coefficients, dtype=float)
+    assert len(keys), "No regression to evaluate"
+    clipped = np.minimum(np.searchsorted(keys, row_keys), len(keys) - 1)
+    found = (keys[clipped] == row_keys) & ~np.isnan(coefficients[clipped, INTERCEPT])
+
+    rows = clipped[found]
+    row_coefficients = coefficients[rows]
+    odometers = data["odometer"].values[found].astype(float)
+    listed_prices = data["price"].values[found].astype(float)
+    mean_absolute_residuals = row_coefficients[:, MEAN_ABSOLUTE_RESIDUAL]
+    # Predicted the same way as `predict_prices`
+    predicted_prices = np.maximum(
+        row_coefficients[:, INTERCEPT] + row_coefficients[:, SLOPE] * odometers, 0
+    )
+    errors = predicted_prices - listed_prices
+    deals = get_deal_categories(
+        predicted_prices, listed_prices, mean_absolute_residuals
+    )
+    deal_codes = (deals[:, None] == DEAL_CATEGORIES).argmax(axis=1)
+
+    # Every metric is a sum per group over the distinct rows of the store
+    groups, group_codes = np.unique(rows, return_inverse=True)
+    group_codes = group_codes.ravel()
+    counts = np.bincount(group_codes, minlength=len(groups))
+    shares = np.zeros((len(groups), len(DEAL_CATEGORIES)))
+    np.add.at(shares, (group_codes, deal_codes), 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        report = pd.DataFrame(
+            {
+                "n": counts,
+                "mae": np.bincount(group_codes, np.abs(errors), len(groups)) / counts,
+                "bias": np.bincount(group_codes, errors, len(groups)) / counts,
+                "mean_absolute_residual": coefficients[groups, MEAN_ABSOLUTE_RESIDUAL],
+            },
+            index=pd.Index(keys[groups], name="key"),
+        )
+        shares /= counts[:, None]
+    # The good, fair and bad bands
+    report["coverage"] = shares[:, 1:4].sum(axis=1)
+    report[SHARE_COLUMNS] = shares
+
+    n = int(found.sum())
+    summary = {
+        "listings": len(data),
+        "n": n,
+        "regressions": len(groups),
+        "unmatched": len(data) - n,
+    }
+    if n:
+        all_shares = shares.T @ counts / n
+        summary.update(
+            {
+                "mae": float(np.abs(errors).mean()),
+                "bias": float(errors.mean()),
+                "mean_absolute_residual": float(mean_absolute_residuals.mean()),
+                "coverage": float(all_shares[1:4].sum()),
+            }
+        )
+        summary.update(zip(SHARE_COLUMNS, all_shares.tolist()))
+    return report[REPORT_COLUMNS], summary
+
+
+def evaluate_store(
+    data: pd.DataFrame,
+    store_dir: str = constants.MODEL_STORE_DIR,
+    candidate: bool = False,
+) -> (pd.DataFrame, dict):
+    """
+    Evaluates the regressions of the model store on the held out listings
+    :param data: held out dataframe (assumed to be clean and formatted)
+    :param store_dir: directory of the model store
+    :param candidate: evaluate the candidate written by training rather than the
+        published version
+    :return: the report and summary of `evaluate_regressions`, the summary also
+        holds the `version` evaluated
+    """
+    if candidate:
+        version, version_dir = "candidate", Path(store_dir) / CANDIDATE_DIR
+    else:
+        version, version_dir = current_version(store_dir)
+    keys, coefficients, _ = read_model_store(version_dir)
+    report, summary = evaluate_regressions(data, keys, coefficients)
+    summary["version"] = version
+    return report, summary
+
+
+def write_report(
+    report: pd.DataFrame, summary: dict, evaluation_dir: str = constants.EVALUATION_DIR
+) -> Path:
+    """
+    Writes the report of every regression as a csv and the summary next to it
+    :param report: dataframe returned by `evaluate_regressions`
+    :param summary: dictionary returned by `evaluate_store`
+    :param evaluation_dir: directory the reports are written to
+    :return: path of the csv written
+    """
+    evaluation_dir = Path(evaluation_dir)
+    evaluation_dir.mkdir(parents=True, exist_ok=True)
+    report_file = evaluation_dir / f"{summary.get('version', 'report')}.csv"
+    report.to_csv(report_file, float_format="%.4f")
+    with open(report_file.with_suffix(".json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return report_file
+
+
+def check_gate(summary: dict, max_mae: float = None, min_coverage: float = None):
+    """
+    :param summary: dictionary returned by `evaluate_store`
+    :param max_mae: highest mean absolute error over the held out listings accepted
+    :param min_coverage: lowest share of listings within the deal bands accepted
+    :return: list of the reasons the store fails the gate, empty if it passes
+    """
+    if not summary["n"]:
+        return ["no held out listing has a regression"]
+    failures = []
+    if max_mae is not None and summary["mae"] > max_mae:
+        failures.append(f"mae {summary['mae']:.1f} above {max_mae}")
+    if min_coverage is not None and summary["coverage"] < min_coverage:
+        failures.append(f"coverage {summary['coverage']:.3f} below {min_coverage}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Evaluate every regression of the model store on the listings "
+        "held out by description and write a report"
+    )
+    parser.add_argument(
+        "--data",
+        default=constants.VEHICLES_CSV,
+        help="vehicles.csv or the directory of the cache written by the ingest",
+    )
+    parser.add_argument("--store-dir", default=constants.MODEL_STORE_DIR)
+    parser.add_argument("--evaluation-dir", default=constants.EVALUATION_DIR)
+    parser.add_argument(
+        "--candidate",
+        action="store_true",
+        help="evaluate the store written by training before it is published",
+    )
+    parser.add_argument("--max-mae", type=float)
+    parser.add_argument("--min-coverage", type=float)
+    parser.add_argument(
+        "--publish",
+        action="store_true",
+        help="publish the candidate store if it passes the gate",
+    )
+    args = parser.parse_args()
+    assert args.candidate or not args.publish, "Only a candidate can be published"
+
+    if Path(args.data).is_dir():
+        df = load_cache(
+            args.data, columns=["model", "year", "odometer", "price"], split="test"
+        )
+    else:
+        _, df = split_by_description_hash(format_raw_df(pd.read_csv(args.data)))
+    report, summary = evaluate_store(df, args.store_dir, args.candidate)
+
+    failures = check_gate(summary, args.max_mae, args.min_coverage)
+    if args.publish and not failures:
+        summary["version"] = publish_model_store(
+            args.store_dir, source_dir=Path(args.store_dir) / CANDIDATE_DIR
+        )
+        print(f"Published version {summary['version']}")
+    elif args.candidate:
+        # The candidate is replaced by every training, keep the report of each one
+        summary["version"] = f"{CANDIDATE_DIR}-{time.strftime('%Y%m%dT%H%M%S')}"
+    print(f"Wrote {write_report(report, summary, args.evaluation_dir)}")
+    print(json.dumps(summary, indent=2))
+
+    if failures:
+        print(f"Version {summary['version']} fails the gate: {', '.join(failures)}")
+        sys.exit(1)
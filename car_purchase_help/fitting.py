@@ -0,0 +1,372 @@
+from pathlib import Path
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from car_purchase_help import constants
+from car_purchase_help.data_processing import remove_outliers, remove_outliers_grouped
+from car_purchase_help.data_visualization import save_lin_reg_plot
+from car_purchase_help.linear_regression import Linear_Regression
+from car_purchase_help.model_store import (
+    current_version,
+    publish_model_store,
+    read_model_store,
+    write_model_store,
+    COEFFICIENT_COLUMNS,
+    STAT_COLUMNS,
+    CANDIDATE_DIR,
+)
+from car_purchase_help.utils import clean_input
+
+
+def fit_lin_regression(
+    df: pd.DataFrame,
+    manufacturer: str,
+    model: str,
+    year: float,
+    save_plots: bool = False,
+) -> str:
+    """
+    Given a car from a certain year fits a linear regression for milage
+    against price and saves the model in a pkl file. For debugging purposes
+    a plot of the linear regression is saved also
+    :param df: dataframe containing the data (assuemd to be clean and formatted)
+    :param manufacturer: manufacturer of the vechicle
+    :param model: model of the vehicle
+    :param year: year of manufacture
+    :return: string indicating the status of the training
+    """
+
+    # Clean the input details and check whether a pkl file already exists for
+    # the car
+    manufacturer, model, year, _ = clean_input(manufacturer, model, year, 1000)
+    model_file = Path(f"../models/{manufacturer}_{model}_{year}.pkl")
+    if model_file.exists():
+        return (
+            "There is already a saved model for this vehicle, "
+            "delete the pkl file if refitting necessary"
+        )
+
+    # Get the data for the vehicle given year from the dataframe
+    data = df[
+        (df["manufacturer"] == manufacturer)
+        & (df["model"] == model)
+        & (df["year"] == year)
+    ]
+
+    # Remove rows that contain outliers in the price column
+    data = remove_outliers(data)
+
+    # Check if there are enough data points to justify a regression to be fit
+    if len(data) < constants.MIN_POINTS_TO_FIT:
+        return (
+            f"There were less than {constants.MIN_POINTS_TO_FIT} entries so did not fit"
+        )
+
+    # Format, then fit the regression
+    X = data["odometer"].values.reshape(len(data), 1)
+    y = data["price"].values.reshape(len(data), 1)
+    linreg = Linear_Regression()
+    linreg.fit(X, y)
+
+    # Save a scatter plot of the data and the regression line TAKES TOO MUCH MEMORY CURRENTLY.
+    # The web app renders the same plot on demand at /plot/<manufacturer>/<model>/<year>.png
+    if save_plots:
+        save_lin_reg_plot(manufacturer, model, year, X, y, linreg.get_y_preds())
+
+    # Save the linear regression object by pickling the binary
+    with open(model_file, "wb") as f:
+        pickle.dump(linreg, f)
+    return "Regression fit and saved successfully"
+
+
+def prepare_training_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Keeps the columns needed for training and cleans the names the same way as
+    `clean_input`, dropping the rows it would reject
+    :param df: dataframe containing the data (assumed to be clean and formatted)
+    :return: dataframe of manufacturer, model, year, odometer and price
+    """
+    data = df[["manufacturer", "model", "year", "odometer", "price"]].copy()
+    data["manufacturer"] = clean_categories(data["manufacturer"], clean_manufacturers)
+    data["model"] = clean_categories(data["model"], clean_models)
+    return data[
+        data["manufacturer"].isin(constants.MANUFACTURERS)
+        & data["year"].isin(constants.YEARS)
+    ]
+
+
+def clean_manufacturers(names: pd.Series) -> pd.Series:
+    """
+    Cleans manufacturer names the same way as `clean_input`
+    :param names: series of manufacturer names
+    :return: series of the stripped lower case names
+    """
+    return names.str.strip().str.lower()
+
+
+def clean_models(names: pd.Series) -> pd.Series:
+    """
+    Cleans model names the same way as `clean_input`
+    :param names: series of model names
+    :return: series of the stripped lower case names without slashes
+    """
+    return (
+        names.str.strip()
+        .str.lower()
+        .str.replace("/", "", regex=False)
+        .str.replace("\\", "", regex=False)
+    )
+
+
+def clean_categories(series: pd.Series, clean) -> pd.Series:
+    """
+    Applies a string cleaning function to the distinct values of a column only,
+    returning a categorical column. Missing values become "nan" as with `astype(str)`
+    :param series: column of strings, categorical or not
+    :param clean: function taking and returning a series of strings
+    :return: categorical series of the cleaned values
+    """
+    series = series.astype("category")
+    codes = series.cat.codes.values
+    categories = pd.Series(series.cat.categories.astype(str))
+    if (codes < 0).any():
+        categories = pd.concat([categories, pd.Series(["nan"])], ignore_index=True)
+        codes = np.where(codes < 0, len(categories) - 1, codes)
+    # Different names may be cleaned to the same one so the categories are rebuilt
+    category_codes, cleaned = pd.factorize(clean(categories))
+    return pd.Series(
+        pd.Categorical.from_codes(category_codes[codes], cleaned), index=series.index
+    )
+
+
+def training_keys(data: pd.DataFrame) -> pd.Series:
+    """
+    :param data: dataframe returned by `prepare_training_frame`
+    :return: series of `manufacturer_model_year` keys for every row
+    """
+    return (
+        data["manufacturer"].astype(str)
+        + "_"
+        + data["model"].astype(str)
+        + "_"
+        + data["year"].astype(int).astype(str)
+    )
+
+
+def sum_statistics(data: pd.DataFrame, by) -> pd.DataFrame:
+    """
+    Computes the sums of the sufficient statistics of every group
+    :param data: dataframe with odometer and price columns
+    :param by: anything `groupby` accepts defining the group of every row
+    :return: dataframe indexed by group with the STAT_COLUMNS except sum_abs_residual
+    """
+    x = data["odometer"].astype(np.float64).values
+    y = data["price"].astype(np.float64).values
+    terms = pd.DataFrame(
+        {
+            "n": np.ones(len(x)),
+            "sum_x": x,
+            "sum_y": y,
+            "sum_xy": x * y,
+            "sum_xx": x * x,
+            "sum_yy": y * y,
+        }
+    )
+    return terms.groupby(by, observed=True).sum()
+
+
+def solve_from_statistics(stats: pd.DataFrame) -> pd.DataFrame:
+    """
+    Solves the single feature least squares regression of every group from its
+    sufficient statistics
+    :param stats: dataframe with the columns of `sum_statistics`
+    :return: dataframe with the intercept, slope and sum of squared residuals
+    """
+    n = stats["n"]
+    sxx = stats["sum_xx"] - stats["sum_x"] ** 2 / n
+    sxy = stats["sum_xy"] - stats["sum_x"] * stats["sum_y"] / n
+    syy = stats["sum_yy"] - stats["sum_y"] ** 2 / n
+    slope = (sxy / sxx).where(sxx > 0, 0.0)
+    return pd.DataFrame(
+        {
+            "intercept": (stats["sum_y"] - slope * stats["sum_x"]) / n,
+            "slope": slope,
+            "sse": (syy - slope * sxy).clip(lower=0),
+        }
+    )
+
+
+def fit_grouped_regressions(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Fits the regression of every manufacturer, model and year in a single pass.
+    The dataframe is grouped once, outliers are removed per group and each single
+    feature regression is solved in closed form from grouped sums
+    :param df: dataframe containing the data (assumed to be clean and formatted)
+    :return: dataframe indexed by manufacturer, model and year with the columns
+        `key`, `intercept`, `slope`, `mean_absolute_residual` and the STAT_COLUMNS.
+        Groups with less than MIN_POINTS_TO_FIT points have NaN coefficients
+    """
+    group_columns = ["manufacturer", "model", "year"]
+    data = prepare_training_frame(df)
+
+    # Remove outliers from the price of every group
+    data = remove_outliers_grouped(data, group_columns)
+    by_group = [data[column].values for column in group_columns]
+
+    # Closed form least squares, centring on the group means for numerical stability
+    x = data["odometer"].astype(np.float64)
+    y = data["price"].astype(np.float64)
+    grouped = data.groupby(group_columns, observed=True)
+    dx = x - grouped["odometer"].transform("mean")
+    dy = y - grouped["price"].transform("mean")
+    sums = (
+        pd.DataFrame({"sxx": dx * dx, "sxy": dx * dy})
+        .groupby(by_group, observed=True)
+        .sum()
+    )
+    fits = sum_statistics(data, by_group)
+    fits["slope"] = (sums["sxy"] / sums["sxx"]).where(sums["sxx"] > 0, 0.0)
+    fits["intercept"] = (fits["sum_y"] - fits["slope"] * fits["sum_x"]) / fits["n"]
+
+    # Mean absolute residual of the training data around each regression line
+    coefficients = data[group_columns].join(
+        fits[["intercept", "slope"]], on=group_columns
+    )
+    residuals = (y - coefficients["intercept"] - coefficients["slope"] * x).abs()
+    fits["sum_abs_residual"] = residuals.groupby(by_group, observed=True).sum()
+    fits["mean_absolute_residual"] = fits["sum_abs_residual"] / fits["n"]
+
+    # Keep the groups without enough points to justify a regression as statistics only
+    pending = fits["n"] < constants.MIN_POINTS_TO_FIT
+    fits.loc[pending, COEFFICIENT_COLUMNS + ["sum_abs_residual"]] = np.nan
+
+    fits.index.names = group_columns
+    fits["key"] = training_keys(fits.index.to_frame(index=False)).values
+    return fits[["key"] + COEFFICIENT_COLUMNS + STAT_COLUMNS]
+
+
+def fit_all_regressions(
+    df: pd.DataFrame, store_dir: str = f"../{constants.MODEL_STORE_DIR}"
+) -> pd.DataFrame:
+    """
+    Fits the regression of every manufacturer, model and year with
+    `fit_grouped_regressions` and writes them all to the model store in one pass
+    :param df: dataframe containing the data (assumed to be clean and formatted)
+    :param store_dir: directory the store is written to
+    :return: dataframe of the fitted regressions
+    """
+    fits = fit_grouped_regressions(df)
+    write_model_store(
+        fits["key"].values,
+        fits[COEFFICIENT_COLUMNS].values,
+        store_dir,
+        fits[STAT_COLUMNS].values,
+    )
+    return fits
+
+
+def update_regressions(
+    df: pd.DataFrame,
+    store_dir: str = f"../{constants.MODEL_STORE_DIR}",
+    publish: bool = True,
+) -> dict:
+    """
+    Folds a batch of new listings into the regressions of the store using the
+    sufficient statistics, without the historical listings. Groups which reach
+    MIN_POINTS_TO_FIT for the first time are fitted.
+    Price outliers of a group with history are rows more than 3 standard deviations
+    from its historical mean price, other groups use the IQR rule within the batch.
+    Absolute residuals of the historical rows are kept from when they were added,
+    and a newly fitted group starts from the residual of a normal distribution with
+    the same squared error.
+    The version served is read and the result is written to the candidate of the
+    store, as by `train.train`, then published as a new version
+    :param df: dataframe of new listings (assumed to be clean and formatted)
+    :param store_dir: directory of the model store
+    :param publish: publish the candidate, otherwise it is only written
+    :return: dictionary counting the groups updated, newly fitted and still pending
+    """
+    keys, coefficients, stats = read_model_store(current_version(store_dir)[1])
+    current = pd.concat(
+        [
+            pd.DataFrame(coefficients, index=keys, columns=COEFFICIENT_COLUMNS),
+            pd.DataFrame(stats, index=keys, columns=STAT_COLUMNS),
+        ],
+        axis=1,
+    )
+
+    data = prepare_training_frame(df)
+    data_keys = training_keys(data)
+
+    # Remove outliers against the history of the group where it has some
+    history = current.reindex(data_keys.values)
+    mean = history["sum_y"] / history["n"]
+    std = np.sqrt(
+        (history["sum_yy"] - history["sum_y"] ** 2 / history["n"]) / (history["n"] - 1)
+    )
+    has_history = (history["n"] >= constants.MIN_POINTS_TO_FIT).values
+    z = np.abs((data["price"].values - mean.values) / std.values)
+    keep = np.where(has_history, z < 3, False)
+    new_groups = data[~has_history].assign(row=np.flatnonzero(~has_history))
+    new_groups = remove_outliers_grouped(new_groups, ["manufacturer", "model", "year"])
+    keep[new_groups["row"].values] = True
+    data, data_keys = data[keep], data_keys[keep]
+
+    # Fold the sums of the batch into the stored statistics
+    batch = sum_statistics(data, data_keys.values)
+    current = current.reindex(current.index.union(batch.index))
+    was_fitted = current["intercept"].notna()
+    sum_columns = STAT_COLUMNS[:-1]
+    current.loc[batch.index, sum_columns] = (
+        current.loc[batch.index, sum_columns].fillna(0) + batch[sum_columns]
+    )
+
+    # Refit every group of the batch with enough points
+    in_batch = current.index.isin(batch.index)
+    refit = in_batch & (current["n"] >= constants.MIN_POINTS_TO_FIT).values
+    solved = solve_from_statistics(current[refit])
+    current.loc[refit, ["intercept", "slope"]] = solved[["intercept", "slope"]]
+
+    # Accumulate the absolute residuals of the new rows for the groups already fitted
+    updated = refit & was_fitted.values
+    rows = current.loc[data_keys.values]
+    batch_residuals = np.abs(
+        data["price"].values
+        - rows["intercept"].values
+        - rows["slope"].values * data["odometer"].values
+    )
+    batch_abs = pd.Series(batch_residuals).groupby(data_keys.values).sum()
+    current.loc[updated, "sum_abs_residual"] += batch_abs.reindex(
+        current.index[updated]
+    ).values
+
+    # The mean absolute residual of a normal distribution is sqrt(2 / pi) times
+    # its standard deviation
+    promoted = refit & ~was_fitted.values
+    estimated = promoted | (updated & current["sum_abs_residual"].isna().values)
+    n = current.loc[estimated, "n"]
+    sse = solved.loc[current.index[estimated], "sse"].values
+    current.loc[estimated, "sum_abs_residual"] = n * np.sqrt(2 / np.pi * sse / n)
+    # Only the groups of the batch change, the others keep the residual they were
+    # stored with
+    changed = updated | estimated
+    current.loc[changed, "mean_absolute_residual"] = (
+        current.loc[changed, "sum_abs_residual"] / current.loc[changed, "n"]
+    )
+
+    candidate_dir = Path(store_dir) / CANDIDATE_DIR
+    write_model_store(
+        current.index.values,
+        current[COEFFICIENT_COLUMNS].values,
+        candidate_dir,
+        current[STAT_COLUMNS].values,
+    )
+    if publish:
+        publish_model_store(store_dir, source_dir=candidate_dir)
+    return {
+        "updated": int(updated.sum()),
+        "promoted": int(promoted.sum()),
+        "pending": int((in_batch & ~refit).sum()),
+    }
@@ -0,0 +1,151 @@
+import argparse
+from pathlib import Path
+import shutil
+
+import pandas as pd
+
+from car_purchase_help import constants
+from car_purchase_help.data_processing import (
+    concat_frames,
+    description_test_mask,
+    drop_description,
+    format_raw_df,
+)
+
+# Columns of vehicles.csv that are used downstream and their types. Everything
+# else, including the urls and image links, is never read
+INGEST_DTYPES = {
+    "id": "float64",
+    "price": "float64",
+    "year": "float64",
+    "manufacturer": "object",
+    "model": "object",
+    "condition": "object",
+    "odometer": "float64",
+    "state": "object",
+    "description": "object",
+    "lat": "float64",
+    "long": "float64",
+}
+PARTITION_COLUMN = "manufacturer"
+# Boolean column marking the rows of the test set, see `description_test_mask`
+SPLIT_COLUMN = "test"
+SPLITS = ["train", "test"]
+
+
+def ingest_vehicles_csv(
+    csv_path: str = constants.VEHICLES_CSV,
+    cache_dir: str = constants.VEHICLES_CACHE_DIR,
+    chunksize: int = constants.INGEST_CHUNKSIZE,
+    columns: list = None,
+    keep_description: bool = True,
+) -> int:
+    """
+    Streams the raw Craigslist csv in chunks, formats each chunk with `format_raw_df`
+    and writes it to a parquet cache partitioned by manufacturer. Only one chunk is
+    ever held in memory. Rows without a manufacturer are not cached. When the
+    description is read every row is assigned to the training or test set from the
+    hash of its description, recorded in the SPLIT_COLUMN
+    :param csv_path: path of vehicles.csv
+    :param cache_dir: directory of the cache, replaced if it already exists
+    :param chunksize: number of csv rows read at a time
+    :param columns: columns to keep, defaults to every column of INGEST_DTYPES
+    :param keep_description: cache the description, which is the largest column, or
+        only the split computed from it
+    :return: number of rows written to the cache
+    """
+    columns = columns or list(INGEST_DTYPES)
+    cache_dir = Path(cache_dir)
+    if cache_dir.exists():
+        shutil.rmtree(cache_dir)
+
+    rows = 0
+    chunks = pd.read_csv(
+        csv_path,
+        usecols=columns,
+        dtype={column: INGEST_DTYPES[column] for column in columns},
+        chunksize=chunksize,
+    )
+    for chunk_number, chunk in enumerate(chunks):
+        chunk = format_raw_df(chunk)
+        if "description" in chunk.columns:
+            chunk[SPLIT_COLUMN] = description_test_mask(chunk["description"])
+        if not keep_description:
+            chunk = drop_description(chunk)
+        for manufacturer, partition in chunk.groupby(PARTITION_COLUMN, observed=True):
+            partition_dir = cache_dir / f"{PARTITION_COLUMN}={manufacturer}"
+            partition_dir.mkdir(parents=True, exist_ok=True)
+            partition = partition.drop(columns=[PARTITION_COLUMN])
+            # Keep the categories of the partition only, not those of the whole chunk
+            for column in partition.select_dtypes("category").columns:
+                partition[column] = partition[column].cat.remove_unused_categories()
+            partition.to_parquet(partition_dir / f"part-{chunk_number:05d}.parquet")
+            rows += len(partition)
+    return rows
+
+
+def load_cache(
+    cache_dir: str = constants.VEHICLES_CACHE_DIR,
+    manufacturers: list = None,
+    columns: list = None,
+    split: str = None,
+) -> pd.DataFrame:
+    """
+    Loads the formatted dataframe back from the cache written by `ingest_vehicles_csv`
+    :param cache_dir: directory of the cache
+    :param manufacturers: only load these manufacturers, defaults to all of them
+    :param columns: only load these columns (besides manufacturer), defaults to all
+    :param split: only load the rows of the "train" or "test" set, defaults to all
+    :return: dataframe as returned by `format_raw_df`
+    """
+    cache_dir = Path(cache_dir)
+    assert cache_dir.exists(), f"No cache at {cache_dir}, run the ingest first"
+    assert split is None or split in SPLITS, f"split is one of {SPLITS}"
+    read_columns = columns
+    if split is not None and columns is not None and SPLIT_COLUMN not in columns:
+        read_columns = columns + [SPLIT_COLUMN]
+    if manufacturers is None:
+        partition_dirs = sorted(cache_dir.glob(f"{PARTITION_COLUMN}=*"))
+    else:
+        partition_dirs = [
+            cache_dir / f"{PARTITION_COLUMN}={manufacturer}"
+            for manufacturer in manufacturers
+        ]
+
+    frames = []
+    for partition_dir in partition_dirs:
+        manufacturer = partition_dir.name.split("=", 1)[1]
+        for part in sorted(partition_dir.glob("*.parquet")):
+            frame = pd.read_parquet(part, columns=read_columns)
+            if split is not None:
+                assert (
+                    SPLIT_COLUMN in frame.columns
+                ), f"{part} has no split, ingest the csv with its description"
+                frame = frame[frame[SPLIT_COLUMN] == (split == "test")]
+                if read_columns is not columns:
+                    frame = frame.drop(columns=[SPLIT_COLUMN])
+            frame[PARTITION_COLUMN] = pd.Categorical([manufacturer] * len(frame))
+            frames.append(frame)
+    return concat_frames(frames)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Stream vehicles.csv into a parquet cache partitioned by manufacturer"
+    )
+    parser.add_argument("--csv", default=constants.VEHICLES_CSV)
+    parser.add_argument("--cache-dir", default=constants.VEHICLES_CACHE_DIR)
+    parser.add_argument("--chunksize", type=int, default=constants.INGEST_CHUNKSIZE)
+    parser.add_argument(
+        "--drop-description",
+        action="store_true",
+        help="only cache the train/test split computed from the description",
+    )
+    args = parser.parse_args()
+    rows = ingest_vehicles_csv(
+        args.csv,
+        args.cache_dir,
+        args.chunksize,
+        keep_description=not args.drop_description,
+    )
+    print(f"Cached {rows} rows in {args.cache_dir}")
@@ -1,6 +1,11 @@
-from sklearn.linear_model import LinearRegression
+import argparse
+from pathlib import Path
+import pickle
+
 import numpy as np
 
+from car_purchase_help import constants
+
 
 class Linear_Regression:
     """
@@ -14,6 +19,9 @@ class Linear_Regression:
         """ 
         Constructor. Just initializes the linear regressor
         """
+        # Imported here so serving the app does not import sklearn
+        from sklearn.linear_model import LinearRegression
+
         self.linreg = LinearRegression()
 
     def fit(self, Xtrain, ytrain) -> None:
@@ -51,3 +59,116 @@ class Linear_Regression:
 
     def get_mean_absolute_residual(self):
         return self.mean_absolute_residual
+
+    def get_intercept(self) -> float:
+        return float(np.ravel(self.linreg.intercept_)[0])
+
+    def get_slope(self) -> float:
+        return float(np.ravel(self.linreg.coef_)[0])
+
+
+class CompactRegression:
+    """
+    Compact version of Linear_Regression with the same `predict` and
+    `get_mean_absolute_residual` interface. Only the coefficients, the mean absolute
+    residual and optionally quantiles of the residuals are kept, without the sklearn
+    estimator or the training data, and predictions are plain arithmetic
+    """
+
+    __slots__ = ("intercept", "slope", "mean_absolute_residual", "quantiles")
+
+    def __init__(
+        self,
+        intercept: float,
+        slope: float,
+        mean_absolute_residual: float,
+        quantiles: tuple = None,
+    ) -> None:
+        """
+        Constructor
+        :param intercept: price predicted at zero mileage
+        :param slope: change in price per mile
+        :param mean_absolute_residual: average distance from training data to the
+            regression line
+        :param quantiles: residuals of the training data at RESIDUAL_QUANTILES
+        """
+        self.intercept = float(intercept)
+        self.slope = float(slope)
+        self.mean_absolute_residual = float(mean_absolute_residual)
+        self.quantiles = None if quantiles is None else tuple(map(float, quantiles))
+
+    @classmethod
+    def from_linear_regression(
+        cls, linreg: Linear_Regression, with_quantiles: bool = True
+    ) -> "CompactRegression":
+        """
+        :param linreg: a fitted Linear_Regression
+        :param with_quantiles: compute the residual quantiles from the training data
+        :return: the CompactRegression making the same predictions
+        """
+        intercept, slope = linreg.get_intercept(), linreg.get_slope()
+        quantiles = None
+        if with_quantiles:
+            x = np.ravel(linreg.get_Xtrain()).astype(np.float64)
+            y = np.ravel(linreg.get_ytrain()).astype(np.float64)
+            quantiles = np.quantile(
+                y - intercept - slope * x, constants.RESIDUAL_QUANTILES
+            )
+        return cls(intercept, slope, linreg.get_mean_absolute_residual(), quantiles)
+
+    def predict(self, x: float) -> float:
+        """
+        Given single odometer value return the price prediciton
+        :param x: float odometer value, or an array of them
+        :return: the price prediciton
+        """
+        return self.intercept + self.slope * x
+
+    # All the getters
+    def get_mean_absolute_residual(self):
+        return self.mean_absolute_residual
+
+    def get_intercept(self) -> float:
+        return self.intercept
+
+    def get_slope(self) -> float:
+        return self.slope
+
+    def get_quantiles(self):
+        return self.quantiles
+
+
+def compact_models(
+    models_dir: str = constants.MODELS_DIR, compact_dir: str = None
+) -> int:
+    """
+    Migrates the pickled Linear_Regressions to CompactRegressions. The originals are
+    kept as they hold the training data needed by the plots and the model store
+    :param models_dir: directory containing the `manufacturer_model_year.pkl` files
+    :param compact_dir: directory the compact pickles are written to with the same
+        names, defaults to the COMPACT_MODELS_SUBDIR of the models directory
+    :return: number of regressions migrated
+    """
+    if compact_dir is None:
+        compact_dir = Path(models_dir) / constants.COMPACT_MODELS_SUBDIR
+    compact_dir = Path(compact_dir)
+    compact_dir.mkdir(parents=True, exist_ok=True)
+    migrated = 0
+    for model_file in sorted(Path(models_dir).glob("*.pkl")):
+        with open(model_file, "rb") as f:
+            linreg = pickle.load(f)
+        with open(compact_dir / model_file.name, "wb") as f:
+            pickle.dump(CompactRegression.from_linear_regression(linreg), f)
+        migrated += 1
+    return migrated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Migrate the pickled regressions to compact regressions"
+    )
+    parser.add_argument("--models-dir", default=constants.MODELS_DIR)
+    parser.add_argument("--compact-dir", default=None)
+    args = parser.parse_args()
+    count = compact_models(args.models_dir, args.compact_dir)
+    print(f"Migrated {count} regressions")
@@ -0,0 +1,82 @@
+import os
+
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    CONTENT_TYPE_LATEST,
+    generate_latest,
+)
+
+STAGE_LATENCY = Histogram(
+    "car_help_stage_seconds",
+    "Latency of each stage of handling a request",
+    ["stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+ADVICE_CACHE = Counter(
+    "car_help_advice_cache_total",
+    "Lookups of the advice cache of retrieve_advice_from_model",
+    ["result"],
+)
+ERRORS = Counter(
+    "car_help_errors_total", "Requests which failed, by exception type", ["exception"]
+)
+SIMILAR_CARS_EVALUATED = Histogram(
+    "car_help_similar_cars_evaluated",
+    "Number of similar cars priced by each model3 call",
+    buckets=(0, 1, 2, 5, 10, 15, 20, 30, 50),
+)
+
+# Regression registries of the process, kept as metrics rather than read from the
+# registries so the workers are aggregated when serving with several processes
+REGISTRY_HITS = Counter("car_help_registry_hits", "Regression registry hits")
+REGISTRY_MISSES = Counter("car_help_registry_misses", "Regression registry misses")
+REGISTRY_EVICTIONS = Counter(
+    "car_help_registry_evictions", "Regression registry evictions"
+)
+REGISTRY_ENTRIES = Gauge(
+    "car_help_registry_entries",
+    "Regressions held by the registries",
+    multiprocess_mode="livesum",
+)
+
+MODEL_VERSION = Gauge(
+    "car_help_model_version",
+    "Version of the model store served, the live version has the value 1",
+    ["version"],
+    multiprocess_mode="liveall",
+)
+
+
+# Versions this process has exported, in the multiprocess mode removing a label
+# does not remove it from the files of the process so older ones are set to 0
+_model_versions = set()
+
+
+def set_model_version(version: str) -> None:
+    """
+    :param version: version of the model store now served
+    """
+    for old_version in _model_versions - {version}:
+        MODEL_VERSION.labels(old_version).set(0)
+    _model_versions.add(version)
+    MODEL_VERSION.labels(version).set(1)
+
+
+def latest_metrics():
+    """
+    Renders the metrics for Prometheus. When gunicorn runs with the
+    prometheus_multiproc_dir environment variable the metrics of all workers are
+    aggregated
+    :return: tuple of the body and its content type
+    """
+    if "prometheus_multiproc_dir" in os.environ:
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -1,73 +1,17 @@
-from os import path
-from pathlib import Path
-import pickle
 from car_purchase_help.utils import clean_input, format_user_input, format_file_name
-from car_purchase_help.data_visualization import save_lin_reg_plot
-from car_purchase_help.data_processing import remove_outliers
 from car_purchase_help import constants
-from car_purchase_help.linear_regression import Linear_Regression
-import pandas as pd
+from car_purchase_help.model_store import (
+    load_model_store,
+    INTERCEPT,
+    SLOPE,
+    MEAN_ABSOLUTE_RESIDUAL,
+)
+from car_purchase_help.registry import get_registry
 import numpy as np
 
-
-def fit_lin_regression(
-    df: pd.DataFrame,
-    manufacturer: str,
-    model: str,
-    year: float,
-    save_plots: bool = False,
-) -> str:
-    """
-    Given a car from a certain year fits a linear regression for milage
-    against price and saves the model in a pkl file. For debugging purposes
-    a plot of the linear regression is saved also
-    :param df: dataframe containing the data (assuemd to be clean and formatted)
-    :param manufacturer: manufacturer of the vechicle
-    :param model: model of the vehicle
-    :param year: year of manufacture
-    :return: string indicating the status of the training
-    """
-
-    # Clean the input details and check whether a pkl file already exists for
-    # the car
-    manufacturer, model, year, _ = clean_input(manufacturer, model, year, 1000)
-    model_file = Path(f"../models/{manufacturer}_{model}_{year}.pkl")
-    if model_file.exists():
-        return (
-            "There is already a saved model for this vehicle, "
-            "delete the pkl file if refitting necessary"
-        )
-
-    # Get the data for the vehicle given year from the dataframe
-    data = df[
-        (df["manufacturer"] == manufacturer)
-        & (df["model"] == model)
-        & (df["year"] == year)
-    ]
-
-    # Remove rows that contain outliers in the price column
-    data = remove_outliers(data)
-
-    # Check if there are enough data points to justify a regression to be fit
-    if len(data) < constants.MIN_POINTS_TO_FIT:
-        return (
-            f"There were less than {constants.MIN_POINTS_TO_FIT} entries so did not fit"
-        )
-
-    # Format, then fit the regression
-    X = data["odometer"].values.reshape(len(data), 1)
-    y = data["price"].values.reshape(len(data), 1)
-    linreg = Linear_Regression()
-    linreg.fit(X, y)
-
-    # Save a scatter plot of the data and the regression line TAKES TOO MUCH MEMORY CURRENTLY
-    if save_plots:
-        save_lin_reg_plot(manufacturer, model, year, X, y, linreg.get_y_preds())
-
-    # Save the linear regression object by pickling the binary
-    with open(model_file, "wb") as f:
-        pickle.dump(linreg, f)
-    return "Regression fit and saved successfully"
+DEAL_CATEGORIES = np.array(["very good", "good", "fair", "bad", "very bad"])
+# Reasons a listing could not be priced by `predict_prices`
+REASON_CODES = np.array(["unknown_manufacturer", "invalid_input", "no_model"])
 
 
 def predict_price(
@@ -85,19 +29,27 @@ def predict_price(
     if not enough data return -1, if regression fails -2, 
     """
 
-    # Clean the input from the user and check that a pkl file exists
+    # Clean the input from the user
     manufacturer, model, year, odometer = clean_input(
         manufacturer, model, year, odometer
     )
-    if from_nb:
-        model_file = Path(f"../models/{manufacturer}_{model}_{year}.pkl")
-    else:
-        model_file = Path(f"models/{manufacturer}_{model}_{year}.pkl")
-    assert path.isfile(model_file), "No regression model for this car from that year"
+    models_dir = f"../{constants.MODELS_DIR}" if from_nb else constants.MODELS_DIR
+    store_dir = (
+        f"../{constants.MODEL_STORE_DIR}" if from_nb else constants.MODEL_STORE_DIR
+    )
 
-    # Load the linear regression and make the prediction
-    with open(model_file, "rb") as f:
-        linreg = pickle.load(f)
+    # Prefer the memory mapped store which needs no file access or unpickling
+    store = load_model_store(store_dir)
+    if store is not None:
+        coefficients = store.get_coefficients(manufacturer, model, year)
+        assert (
+            coefficients is not None
+        ), "No regression model for this car from that year"
+        intercept, slope, mean_absolute_residual = coefficients
+        return max(intercept + slope * odometer, 0), mean_absolute_residual
+
+    # Otherwise get the linear regression from the registry and make the prediction
+    linreg = get_registry(models_dir).get(manufacturer, model, year)
     prediction = linreg.predict(x=odometer)
 
     # Check the prediction returned a value and return it
@@ -140,3 +92,156 @@ def get_advice(
         return "This appears to be a <b>bad</b> deal."
     else:
         return "This appears to be a <b>very bad</b> deal."
+
+
+def get_deal_categories(
+    predicted_prices: np.ndarray,
+    listed_prices: np.ndarray,
+    mean_absolute_residuals: np.ndarray,
+) -> np.ndarray:
+    """
+    Vectorized version of `get_advice` which returns the deal category of each listing
+    rather than the text recommendation
+    :param predicted_prices: array of prices predicted for the vehicles
+    :param listed_prices: array of prices the vehicles are listed for
+    :param mean_absolute_residuals: array of mean absolute residuals of the models
+    :return: array of categories from DEAL_CATEGORIES
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        factor = (
+            np.asarray(predicted_prices, dtype=float)
+            - np.asarray(listed_prices, dtype=float)
+        ) / np.asarray(mean_absolute_residuals, dtype=float)
+    diff = constants.RESIDUAL_FACTOR_DIFF
+    conditions = [
+        factor > 2 * diff,
+        (diff < factor) & (factor <= 2 * diff),
+        np.abs(factor) <= diff,
+        (-2 * diff <= factor) & (factor < -diff),
+    ]
+    return np.select(conditions, DEAL_CATEGORIES[:4], default=DEAL_CATEGORIES[4])
+
+
+def get_deal_category(
+    predicted_price: float, listed_price: float, mean_absolute_residual: float
+) -> str:
+    """
+    :param predicted_price: the price the model predicted for the vehicle
+    :param listed_price: the price the vehicle is listed for on the internet
+    :param mean_absolute_residual: average distance from training data to the regression line
+    :return: the deal category from DEAL_CATEGORIES matching `get_advice`
+    """
+    return str(
+        get_deal_categories(
+            [predicted_price], [listed_price], [mean_absolute_residual]
+        )[0]
+    )
+
+
+def gather_coefficients(keys: np.ndarray, from_nb: bool = False) -> np.ndarray:
+    """
+    Gathers the coefficients of many regressions at once
+    :param keys: array of keys of the form `manufacturer_model_year`
+    :param from_nb: boolean whether the function call is in a notebook
+    :return: array of shape (len(keys), 3) of intercept, slope and mean absolute
+        residual, NaN for the keys that have no regression
+    """
+    store_dir = (
+        f"../{constants.MODEL_STORE_DIR}" if from_nb else constants.MODEL_STORE_DIR
+    )
+    store = load_model_store(store_dir)
+    coefficients = np.full((len(keys), 3), np.nan)
+    if store is not None:
+        idx = store.index_many(keys)
+        found = idx >= 0
+        coefficients[found] = store.coefficients[idx[found]]
+        return coefficients
+
+    # Without the store fall back to the registry, loading each distinct car once
+    models_dir = f"../{constants.MODELS_DIR}" if from_nb else constants.MODELS_DIR
+    registry = get_registry(models_dir)
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    unique_coefficients = np.full((len(unique_keys), 3), np.nan)
+    for i, key in enumerate(unique_keys):
+        manufacturer, model_year = key.split("_", 1)
+        model, year = model_year.rsplit("_", 1)
+        if registry.has_model(manufacturer, model, year):
+            linreg = registry.get(manufacturer, model, year)
+            unique_coefficients[i] = [
+                linreg.get_intercept(),
+                linreg.get_slope(),
+                linreg.get_mean_absolute_residual(),
+            ]
+    coefficients[:] = unique_coefficients[inverse.ravel()]
+    return coefficients
+
+
+def predict_prices(listings, from_nb: bool = False) -> dict:
+    """
+    Prices many listings in one pass over the gathered coefficients. Rows which
+    cannot be priced are flagged instead of raising
+    :param listings: DataFrame or dictionary of arrays with the columns `manufacturer`,
+        `model`, `year`, `odometer` and optionally the listed `price`
+    :param from_nb: boolean whether the function call is in a notebook
+    :return: dictionary of arrays `predicted_price`, `mean_absolute_residual` and
+        `mileage_decrease` (NaN where there is no model), `deal` (empty where there
+        is no model or listed price), the boolean `has_model` and `reason` (one of
+        REASON_CODES where there is no model, empty otherwise)
+    """
+    # Clean the input the same way as `clean_input`
+    manufacturers = np.asarray(listings["manufacturer"], dtype=str)
+    manufacturers = np.char.lower(np.char.strip(manufacturers))
+    models = np.asarray(listings["model"], dtype=str)
+    models = np.char.lower(np.char.strip(models))
+    models = np.char.replace(np.char.replace(models, "/", ""), "\\", "")
+    years = np.asarray(listings["year"], dtype=float)
+    odometers = np.asarray(listings["odometer"], dtype=float)
+
+    known_manufacturer = np.isin(manufacturers, constants.MANUFACTURERS)
+    valid_input = (
+        np.isin(years, constants.YEARS)
+        & (odometers > 0)
+        & (odometers < constants.MAX_ODOMETER)
+    )
+    valid = known_manufacturer & valid_input
+    year_text = np.where(valid, years, -1).astype(int).astype(str)
+    keys = np.char.add(
+        np.char.add(np.char.add(manufacturers, "_"), np.char.add(models, "_")),
+        year_text,
+    )
+
+    coefficients = gather_coefficients(keys, from_nb)
+    has_model = valid & ~np.isnan(coefficients[:, INTERCEPT])
+    odometers = np.where(has_model, odometers, np.nan)
+    predicted_prices = np.maximum(
+        coefficients[:, INTERCEPT] + coefficients[:, SLOPE] * odometers, 0
+    )
+    predicted_prices[~has_model] = np.nan
+    mean_absolute_residuals = np.where(
+        has_model, coefficients[:, MEAN_ABSOLUTE_RESIDUAL], np.nan
+    )
+    # As in `get_mileage_decrease` only a positive decrease is a prediction
+    mileage_decreases = -coefficients[:, SLOPE] * constants.MILEAGE_DECREASE_PERIOD
+    mileage_decreases[~has_model | ~(mileage_decreases > 0)] = np.nan
+    reasons = np.select(
+        [~known_manufacturer, ~valid_input, ~has_model], REASON_CODES, default=""
+    )
+
+    deals = np.full(len(keys), "", dtype=DEAL_CATEGORIES.dtype)
+    if "price" in listings:
+        listed_prices = np.asarray(listings["price"], dtype=float)
+        priced = has_model & ~np.isnan(listed_prices)
+        deals[priced] = get_deal_categories(
+            predicted_prices[priced],
+            listed_prices[priced],
+            mean_absolute_residuals[priced],
+        )
+
+    return {
+        "predicted_price": predicted_prices,
+        "mean_absolute_residual": mean_absolute_residuals,
+        "deal": deals,
+        "mileage_decrease": mileage_decreases,
+        "has_model": has_model,
+        "reason": reasons,
+    }
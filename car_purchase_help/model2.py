@@ -1,11 +1,10 @@
-from os import path
-from pathlib import Path
-import pickle
 from car_purchase_help.utils import clean_input
 from car_purchase_help import constants
+from car_purchase_help.model_store import load_model_store
+from car_purchase_help.registry import get_registry
 
 
-def predict_mileage_cost(manufacturer: str, model: str, year: int):
+def get_mileage_decrease(manufacturer: str, model: str, year: int) -> float:
     """
     Given a vehicle from a certain year predict the amount
     of value it loses for each 10,000 miles driven
@@ -15,18 +14,43 @@ def predict_mileage_cost(manufacturer: str, model: str, year: int):
     :return: amount the value will decrease every 10,000 miles driven
     """
     manufacturer, model, year, _ = clean_input(manufacturer, model, year, 1000)
-    model_file = Path(f"models/{manufacturer}_{model}_{year}.pkl")
-    # assert path.isfile(model_file), "No regression model for this car from that year"
 
-    # Load the linear regression and make the prediction
-    with open(model_file, "rb") as f:
-        linreg = pickle.load(f)
-
-    initial_value = linreg.predict(x=0)
-    end_value = linreg.predict(x=constants.MILEAGE_DECREASE_PERIOD)
-    decrease = initial_value - end_value
+    # The value lost over the period is the slope of the regression, so with the
+    # store built no regression needs to be loaded
+    store = load_model_store()
+    if store is not None:
+        coefficients = store.get_coefficients(manufacturer, model, year)
+        assert (
+            coefficients is not None
+        ), "No regression model for this car from that year"
+        _, slope, _ = coefficients
+        decrease = -slope * constants.MILEAGE_DECREASE_PERIOD
+    else:
+        # Get the linear regression from the registry and make the prediction
+        linreg = get_registry().get(manufacturer, model, year)
+        initial_value = linreg.predict(x=0)
+        end_value = linreg.predict(x=constants.MILEAGE_DECREASE_PERIOD)
+        decrease = initial_value - end_value
     assert decrease > 0, "Mileage cost prediction failed"
+    return decrease
+
 
+def predict_mileage_cost(manufacturer: str, model: str, year: int) -> str:
+    """
+    Text version of `get_mileage_decrease` to be provided to the user
+    :param manufacturer: the maker of the car
+    :param model: the model of car
+    :param year: the year the car was released
+    :return: advice on the value lost every 10,000 miles driven
+    """
+    return format_mileage_cost(get_mileage_decrease(manufacturer, model, year))
+
+
+def format_mileage_cost(decrease: float) -> str:
+    """
+    :param decrease: amount the value will decrease every 10,000 miles driven
+    :return: advice on the value lost every 10,000 miles driven
+    """
     return (
         "For every 10,000 additional miles this car is driven"
         f", its value will decrease by approximately <b>${round(decrease, 2)}</b>."
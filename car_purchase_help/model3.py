@@ -1,40 +1,74 @@
-import ast
-from pathlib import Path
+import numpy as np
 
-from car_purchase_help.model1 import predict_price
-from car_purchase_help.model2 import predict_mileage_cost
+from car_purchase_help import constants
+from car_purchase_help.metrics import SIMILAR_CARS_EVALUATED
+from car_purchase_help.model1 import gather_coefficients
+from car_purchase_help.model2 import format_mileage_cost
+from car_purchase_help.model_store import model_key, INTERCEPT, SLOPE
+from car_purchase_help.similar_cars import load_similar_cars_index
+
+
+def get_similar_prices(manufacturer: str, model: str, year: int, odometer: int):
+    """
+    For a vechicle looks up vehicles classed as similar and predicts their price and
+    mileage reduction like model1 and model2, all in one vectorized lookup
+    :param manufacturer: cleaned manufacturer of the vechicle
+    :param model: cleaned model of the vehicle
+    :param year: year of manufacture
+    :param odometer: mileage of the vehicle
+    :return: list of dictionaries with the manufacturer, model, predicted price and
+        mileage decrease of each similar vehicle that has a model, or None if there
+        are no similar vehicles listed for the car
+    """
+    similar_cars = load_similar_cars_index().similar_cars(manufacturer, model, year)
+    if similar_cars is None:
+        return None
+
+    manufacturers, models = similar_cars
+    SIMILAR_CARS_EVALUATED.observe(len(manufacturers))
+    keys = [model_key(*car, year) for car in zip(manufacturers, models)]
+    coefficients = gather_coefficients(np.array(keys, dtype=str))
+    prices = np.maximum(
+        coefficients[:, INTERCEPT] + coefficients[:, SLOPE] * odometer, 0
+    )
+    decreases = -coefficients[:, SLOPE] * constants.MILEAGE_DECREASE_PERIOD
+
+    # Cars whose value does not decrease with mileage have no mileage advice
+    return [
+        {
+            "manufacturer": str(car_manu),
+            "model": str(car_model),
+            "predicted_price": float(price),
+            "mileage_decrease": float(decrease),
+        }
+        for car_manu, car_model, price, decrease in zip(
+            manufacturers, models, prices, decreases
+        )
+        if decrease > 0
+    ]
 
 
 def get_similar_advice(manufacturer: str, model: str, year: int, odometer: int) -> str:
     """
     For a vechicle looks up vehicles classed as similar and returns their predicted price
     and information about mileage reduction from model1 and model2
-    :param df: dataframe containing the data (assuemd to be clean and formatted)
     :param manufacturer: manufacturer of the vechicle
     :param model: model of the vehicle
     :param year: year of manufacture
     :return: string of advice
     """
-    similar_cars_path = Path(f"data/clean_similar_cars.txt")
-    with open(similar_cars_path, "r") as f:
-        similar_cars_dict = ast.literal_eval(f.read())
     ret_str = (
         "<br><br><br><b>Here is the same information but for similar vehicles "
         "for the same year and mileage</b><br>"
     )
 
-    try:
-        similar_cars = similar_cars_dict[f"{manufacturer}_{model}"]
-    except:
+    similar_prices = get_similar_prices(manufacturer, model, year, odometer)
+    if similar_prices is None:
         return ret_str + "<br/>Sorry no similar vehicles were available"
 
-    for car in similar_cars:
-        car_manu = car.split("_")[0]
-        car_model = car.split("_")[1]
-        try:
-            price, _ = predict_price(car_manu, car_model, year, odometer)
-            mileage_advice = predict_mileage_cost(car_manu, car_model, year)
-            ret_str += f"<b>{car_manu.title()}</b>, <b>{car_model.title()}</b>: would cost approximately ${round(price, 2)}. {mileage_advice}<br/>"
-        except:
-            pass
+    for car in similar_prices:
+        car_manu, car_model = car["manufacturer"], car["model"]
+        price = car["predicted_price"]
+        mileage_advice = format_mileage_cost(car["mileage_decrease"])
+        ret_str += f"<b>{car_manu.title()}</b>, <b>{car_model.title()}</b>: would cost approximately ${round(price, 2)}. {mileage_advice}<br/>"
     return ret_str
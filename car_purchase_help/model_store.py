@@ -0,0 +1,338 @@
+import argparse
+import os
+from pathlib import Path
+import pickle
+import shutil
+import time
+
+import numpy as np
+
+from car_purchase_help import constants
+from car_purchase_help.metrics import STAGE_LATENCY, set_model_version
+
+KEYS_FILE = "keys.npy"
+COEFFICIENTS_FILE = "coefficients.npy"
+STATS_FILE = "stats.npy"
+# Published snapshots of the store live in VERSIONS_DIR, CURRENT holds the name of
+# the one served. Without CURRENT the files at the top of the store are served
+VERSIONS_DIR = "versions"
+CURRENT_FILE = "CURRENT"
+UNVERSIONED = "unversioned"
+# Training writes to CANDIDATE_DIR, never to the files served, until it is published
+CANDIDATE_DIR = "candidate"
+# Column positions in the coefficients array
+INTERCEPT, SLOPE, MEAN_ABSOLUTE_RESIDUAL = 0, 1, 2
+COEFFICIENT_COLUMNS = ["intercept", "slope", "mean_absolute_residual"]
+# Sufficient statistics of the training data kept so the regressions can be
+# updated with new listings. Groups below MIN_POINTS_TO_FIT are stored with their
+# statistics and NaN coefficients until they have enough points
+STAT_COLUMNS = [
+    "n",
+    "sum_x",
+    "sum_y",
+    "sum_xy",
+    "sum_xx",
+    "sum_yy",
+    "sum_abs_residual",
+]
+
+
+def model_key(manufacturer: str, model: str, year: int) -> str:
+    """
+    Key of a regression in the store. Matches the stem of the pkl file names
+    :param manufacturer: cleaned manufacturer of the vehicle
+    :param model: cleaned model of the vehicle
+    :param year: year of manufacture
+    :return: key of the form `manufacturer_model_year`
+    """
+    return f"{manufacturer}_{model}_{int(year)}"
+
+
+def save_array(path: Path, array: np.ndarray) -> None:
+    """
+    Saves an array under a temporary name and moves it over the file. A server
+    memory mapping the previous file keeps reading it, rewriting it in place could
+    truncate the pages under the server
+    :param path: path of the `.npy` file
+    :param array: array saved
+    """
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def write_model_store(keys, coefficients, store_dir: str, stats=None) -> int:
+    """
+    Writes the sorted key index and the coefficient array of the store
+    :param keys: iterable of keys as produced by `model_key`
+    :param coefficients: array of shape (len(keys), 3) holding intercept, slope and
+        mean absolute residual in the same order as the keys
+    :param store_dir: directory the store is written to
+    :param stats: optional array of shape (len(keys), len(STAT_COLUMNS)) of the
+        sufficient statistics in the same order as the keys
+    :return: number of regressions written
+    """
+    keys = np.asarray(keys, dtype=str)
+    coefficients = np.asarray(coefficients, dtype=np.float64).reshape(len(keys), 3)
+    order = np.argsort(keys)
+    store_dir = Path(store_dir)
+    store_dir.mkdir(parents=True, exist_ok=True)
+    save_array(store_dir / KEYS_FILE, keys[order])
+    save_array(store_dir / COEFFICIENTS_FILE, coefficients[order])
+    if stats is not None:
+        stats = np.asarray(stats, dtype=np.float64)
+        stats = stats.reshape(len(keys), len(STAT_COLUMNS))
+        save_array(store_dir / STATS_FILE, stats[order])
+    elif (store_dir / STATS_FILE).exists():
+        # Statistics of a previous store would no longer line up with the keys
+        (store_dir / STATS_FILE).unlink()
+    return len(keys)
+
+
+def read_model_store(store_dir: str):
+    """
+    Reads the whole store into memory, for example to modify and rewrite it
+    :param store_dir: directory the store was written to
+    :return: tuple of keys, coefficients and statistics. The statistics are NaN when
+        the store was written without them, everything is empty if there is no store
+    """
+    store_dir = Path(store_dir)
+    if not (store_dir / KEYS_FILE).exists():
+        return (
+            np.array([], dtype=str),
+            np.empty((0, 3)),
+            np.empty((0, len(STAT_COLUMNS))),
+        )
+    keys = np.load(store_dir / KEYS_FILE)
+    coefficients = np.load(store_dir / COEFFICIENTS_FILE)
+    if (store_dir / STATS_FILE).exists():
+        stats = np.load(store_dir / STATS_FILE)
+    else:
+        stats = np.full((len(keys), len(STAT_COLUMNS)), np.nan)
+    return keys, coefficients, stats
+
+
+def build_model_store(
+    models_dir: str = constants.MODELS_DIR, store_dir: str = constants.MODEL_STORE_DIR
+) -> int:
+    """
+    Converts every pickled Linear_Regression in the models directory into the
+    single memory mapped store
+    :param models_dir: directory containing the `manufacturer_model_year.pkl` files
+    :param store_dir: directory the store is written to
+    :return: number of regressions converted
+    """
+    keys, coefficients, stats = [], [], []
+    for model_file in sorted(Path(models_dir).glob("*.pkl")):
+        with open(model_file, "rb") as f:
+            linreg = pickle.load(f)
+        intercept = float(np.ravel(linreg.linreg.intercept_)[0])
+        slope = float(np.ravel(linreg.linreg.coef_)[0])
+        mean_absolute_residual = float(linreg.get_mean_absolute_residual())
+        keys.append(model_file.stem)
+        coefficients.append([intercept, slope, mean_absolute_residual])
+
+        # The pickles hold the training data so the statistics can be recovered.
+        # The residual sum is scaled from the mean absolute residual of the pickle
+        # rather than recomputed, so `update_regressions` keeps the deal bands served
+        x = np.ravel(linreg.get_Xtrain()).astype(np.float64)
+        y = np.ravel(linreg.get_ytrain()).astype(np.float64)
+        stats.append(
+            [
+                len(x),
+                x.sum(),
+                y.sum(),
+                (x * y).sum(),
+                (x * x).sum(),
+                (y * y).sum(),
+                mean_absolute_residual * len(x),
+            ]
+        )
+    return write_model_store(keys, coefficients, store_dir, stats)
+
+
+def current_version(store_dir: str) -> (str, Path):
+    """
+    :param store_dir: directory of the store
+    :return: tuple of the name of the version served and the directory of its files
+    """
+    store_dir = Path(store_dir)
+    current_file = store_dir / CURRENT_FILE
+    if current_file.exists():
+        version = current_file.read_text().strip()
+        return version, store_dir / VERSIONS_DIR / version
+    return UNVERSIONED, store_dir
+
+
+def publish_model_store(
+    store_dir: str = constants.MODEL_STORE_DIR,
+    version: str = None,
+    keep: int = constants.MODEL_STORE_KEEP_VERSIONS,
+    source_dir: str = None,
+) -> str:
+    """
+    Snapshots the files of a store into a new version and switches CURRENT to it.
+    The snapshot is complete before CURRENT is atomically replaced, so a server
+    never reads a partially written store
+    :param store_dir: directory of the store
+    :param version: name of the version, defaults to the current time
+    :param keep: number of versions kept, older ones are deleted
+    :param source_dir: directory of the files snapshotted, such as the candidate
+        written by training, defaults to the files at the top of the store
+    :return: the name of the version published
+    """
+    store_dir = Path(store_dir)
+    source_dir = store_dir if source_dir is None else Path(source_dir)
+    assert (source_dir / KEYS_FILE).exists(), f"No store to publish in {source_dir}"
+    version = version or time.strftime("%Y%m%dT%H%M%S")
+    version_dir = store_dir / VERSIONS_DIR / version
+    assert not version_dir.exists(), f"Version {version} already exists"
+
+    staging_dir = version_dir.with_name(f".{version}.tmp")
+    if staging_dir.exists():
+        shutil.rmtree(staging_dir)
+    staging_dir.mkdir(parents=True)
+    for file_name in [KEYS_FILE, COEFFICIENTS_FILE, STATS_FILE]:
+        if (source_dir / file_name).exists():
+            shutil.copy2(source_dir / file_name, staging_dir / file_name)
+    os.replace(staging_dir, version_dir)
+
+    current_tmp = store_dir / f".{CURRENT_FILE}.tmp"
+    current_tmp.write_text(version)
+    os.replace(current_tmp, store_dir / CURRENT_FILE)
+
+    # Versions sort by name, the default names by time. Deleting the files of a
+    # version still memory mapped by a server is safe, the mapping stays valid
+    versions = sorted(
+        path.name
+        for path in (store_dir / VERSIONS_DIR).iterdir()
+        if path.is_dir() and not path.name.startswith(".") and path.name != version
+    )
+    for old_version in versions[: max(0, len(versions) - keep + 1)]:
+        shutil.rmtree(store_dir / VERSIONS_DIR / old_version)
+    return version
+
+
+class ModelStore:
+    """
+    Read only view of the coefficients of every regression. The arrays are memory
+    mapped so a lookup never opens a file and processes share the pages
+    """
+
+    def __init__(self, store_dir: str = constants.MODEL_STORE_DIR) -> None:
+        """
+        Constructor. Memory maps the key index and the coefficients of the version
+        of the store currently published
+        :param store_dir: directory the store was written to
+        """
+        self.version, store_dir = current_version(store_dir)
+        self.keys = np.load(store_dir / KEYS_FILE, mmap_mode="r")
+        self.coefficients = np.load(store_dir / COEFFICIENTS_FILE, mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key: str) -> bool:
+        i = self.index(key)
+        return i >= 0 and not np.isnan(self.coefficients[i, INTERCEPT])
+
+    def index(self, key: str) -> int:
+        """
+        Binary search of the sorted key index
+        :param key: key as produced by `model_key`
+        :return: row of the key in the coefficients array, -1 if it is not stored
+        """
+        i = int(np.searchsorted(self.keys, key))
+        if i < len(self.keys) and self.keys[i] == key:
+            return i
+        return -1
+
+    def index_many(self, keys) -> np.ndarray:
+        """
+        Vectorized `index` over an array of keys
+        :param keys: array of keys as produced by `model_key`
+        :return: array of rows in the coefficients array, -1 where a key is not stored
+        """
+        keys = np.asarray(keys, dtype=str)
+        if len(self.keys) == 0:
+            return np.full(len(keys), -1)
+        idx = np.searchsorted(self.keys, keys)
+        clipped = np.minimum(idx, len(self.keys) - 1)
+        return np.where(self.keys[clipped] == keys, clipped, -1)
+
+    def get_coefficients(self, manufacturer: str, model: str, year: int):
+        """
+        :param manufacturer: cleaned manufacturer of the vehicle
+        :param model: cleaned model of the vehicle
+        :param year: year of manufacture
+        :return: tuple of intercept, slope and mean absolute residual or None if
+            there is no regression for the car
+        """
+        i = self.index(model_key(manufacturer, model, year))
+        if i < 0 or np.isnan(self.coefficients[i, INTERCEPT]):
+            return None
+        intercept, slope, mean_absolute_residual = self.coefficients[i]
+        return float(intercept), float(slope), float(mean_absolute_residual)
+
+
+_stores = {}
+
+
+def load_model_store(store_dir: str = constants.MODEL_STORE_DIR):
+    """
+    Loads the store once per process. A newer version is only picked up by
+    `reload.reload_models`
+    :param store_dir: directory the store was written to
+    :return: the ModelStore or None if it has not been built
+    """
+    if store_dir not in _stores:
+        _, version_dir = current_version(store_dir)
+        if not (version_dir / KEYS_FILE).exists():
+            return None
+        with STAGE_LATENCY.labels("model_load").time():
+            _stores[store_dir] = ModelStore(store_dir)
+        set_model_version(_stores[store_dir].version)
+    return _stores[store_dir]
+
+
+def loaded_model_store(store_dir: str = constants.MODEL_STORE_DIR):
+    """
+    :param store_dir: directory the store was written to
+    :return: the ModelStore loaded by this process, None if it has not been loaded
+    """
+    return _stores.get(store_dir)
+
+
+def replace_model_store(store_dir: str, store: ModelStore) -> None:
+    """
+    Serves `store` from now on in place of the one loaded by `load_model_store`
+    :param store_dir: directory the store was written to
+    :param store: the ModelStore of the new version
+    """
+    _stores[store_dir] = store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the model store from the pickled regressions"
+    )
+    parser.add_argument("--models-dir", default=constants.MODELS_DIR)
+    parser.add_argument("--store-dir", default=constants.MODEL_STORE_DIR)
+    parser.add_argument(
+        "--publish",
+        action="store_true",
+        help="publish the store as a new version for the running servers to reload",
+    )
+    parser.add_argument(
+        "--publish-only",
+        action="store_true",
+        help="publish the store as it is, without rebuilding it from the pickles",
+    )
+    args = parser.parse_args()
+    if not args.publish_only:
+        count = build_model_store(args.models_dir, args.store_dir)
+        print(f"Wrote {count} regressions to {args.store_dir}")
+    if args.publish or args.publish_only:
+        version = publish_model_store(args.store_dir)
+        print(f"Published version {version} of {args.store_dir}")
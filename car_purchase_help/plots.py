@@ -0,0 +1,241 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+from pathlib import Path
+import pickle
+import threading
+
+import numpy as np
+
+from car_purchase_help import constants
+from car_purchase_help.metrics import STAGE_LATENCY
+from car_purchase_help.model_store import load_model_store, model_key, UNVERSIONED
+from car_purchase_help.reload import live_version
+
+
+class PlotRenderer:
+    """
+    Renders the regression plots on demand. The points are the training data kept in
+    the original pickles of the regressions, the line and deal boundaries are drawn
+    from the coefficients served by the model store. Rendering happens in a bounded
+    pool of threads, each reusing one figure drawn with the non interactive Agg
+    canvas, and the PNGs are kept in a disk cache, per version of the store, whose
+    total size is capped by removing the least recently used images
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = constants.PLOT_CACHE_DIR,
+        models_dir: str = constants.MODELS_DIR,
+        max_bytes: int = constants.PLOT_CACHE_MAX_BYTES,
+        workers: int = constants.PLOT_WORKERS,
+        store_dir: str = constants.MODEL_STORE_DIR,
+    ) -> None:
+        """
+        Constructor
+        :param cache_dir: directory of the rendered PNGs
+        :param models_dir: directory containing the `manufacturer_model_year.pkl` files
+        :param max_bytes: maximum total size of the cached PNGs
+        :param workers: number of threads rendering plots
+        :param store_dir: directory of the model store the coefficients are read from
+        """
+        self.cache_dir = Path(cache_dir)
+        self.models_dir = Path(models_dir)
+        self.store_dir = store_dir
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="plot"
+        )
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # Renders in progress, so concurrent requests for a car share one
+        self.pending = {}
+        self.total_bytes = None
+
+    def cache_file(
+        self, manufacturer: str, model: str, year: int, version: str
+    ) -> Path:
+        return self.cache_dir / f"{model_key(manufacturer, model, year)}-{version}.png"
+
+    def model_file(self, manufacturer: str, model: str, year: int) -> Path:
+        return self.models_dir / f"{model_key(manufacturer, model, year)}.pkl"
+
+    def has_training_data(self, manufacturer: str, model: str, year: int) -> bool:
+        """
+        :return: whether the training data of the car is kept to plot it. Cars first
+            fitted by `update_regressions` are only in the store
+        """
+        return self.model_file(manufacturer, model, year).exists()
+
+    def get_png(self, manufacturer: str, model: str, year: int) -> bytes:
+        """
+        Returns the plot of the car from the cache, rendering it if needed
+        :param manufacturer: cleaned manufacturer of the vehicle
+        :param model: cleaned model of the vehicle
+        :param year: year of manufacture
+        :return: the PNG image
+        """
+        # The version is part of the name so a reload never serves an older plot
+        version = live_version(self.store_dir) or UNVERSIONED
+        cache_file = self.cache_file(manufacturer, model, year, version)
+        try:
+            png = cache_file.read_bytes()
+            # The modification time orders the images for eviction
+            os.utime(cache_file)
+            return png
+        except FileNotFoundError:
+            pass
+
+        key = cache_file.name
+        with self.lock:
+            future = self.pending.get(key)
+            if future is None:
+                future = self.executor.submit(
+                    self.render, manufacturer, model, year, version
+                )
+                self.pending[key] = future
+        try:
+            png = future.result(timeout=constants.PLOT_TIMEOUT)
+        finally:
+            with self.lock:
+                if self.pending.get(key) is future and future.done():
+                    del self.pending[key]
+        return png
+
+    def figure(self):
+        """
+        :return: the figure of the current thread, created on its first render
+        """
+        if not hasattr(self.local, "figure"):
+            # Imported here so serving the other endpoints does not import matplotlib
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            from matplotlib.figure import Figure
+
+            figure = Figure(figsize=(8, 6), dpi=100)
+            FigureCanvasAgg(figure)
+            self.local.figure = figure
+        return self.local.figure
+
+    def coefficients(self, manufacturer: str, model: str, year: int, linreg):
+        """
+        :param manufacturer: cleaned manufacturer of the vehicle
+        :param model: cleaned model of the vehicle
+        :param year: year of manufacture
+        :param linreg: the pickled regression of the car
+        :return: tuple of intercept, slope and mean absolute residual the advice is
+            given from, those of the store or of the pickle without a store
+        """
+        store = load_model_store(self.store_dir)
+        if store is None:
+            return (
+                linreg.get_intercept(),
+                linreg.get_slope(),
+                linreg.get_mean_absolute_residual(),
+            )
+        coefficients = store.get_coefficients(manufacturer, model, year)
+        assert (
+            coefficients is not None
+        ), "No regression model for this car from that year"
+        return coefficients
+
+    def render(self, manufacturer: str, model: str, year: int, version: str) -> bytes:
+        """
+        Draws the plot saved by `save_lin_reg_plot` during training and stores it in
+        the cache. The training data is read from the original pickle of the car, the
+        regression line and deal boundaries are those of the advice
+        :param manufacturer: cleaned manufacturer of the vehicle
+        :param model: cleaned model of the vehicle
+        :param year: year of manufacture
+        :param version: version of the model store the plot is cached for
+        :return: the PNG image
+        """
+        from car_purchase_help.data_visualization import draw_lin_reg_plot
+
+        with STAGE_LATENCY.labels("plot").time():
+            with open(self.model_file(manufacturer, model, year), "rb") as f:
+                linreg = pickle.load(f)
+            intercept, slope, mean_absolute_residual = self.coefficients(
+                manufacturer, model, year, linreg
+            )
+            X = linreg.get_Xtrain()
+            # Predicted the same way as `predict_price`
+            y_preds = np.maximum(intercept + slope * np.sort(X, axis=0), 0)
+            figure = self.figure()
+            figure.clear()
+            ax = figure.add_subplot()
+            draw_lin_reg_plot(
+                ax,
+                manufacturer,
+                model,
+                year,
+                X,
+                linreg.get_ytrain(),
+                y_preds,
+                mean_absolute_residual,
+            )
+            buffer = io.BytesIO()
+            figure.savefig(buffer, format="png", bbox_inches="tight")
+            # Drop the artists so the idle figure does not hold on to the data
+            figure.clear()
+        png = buffer.getvalue()
+        self.store(self.cache_file(manufacturer, model, year, version), png)
+        return png
+
+    def store(self, cache_file: Path, png: bytes) -> None:
+        """
+        Writes the image to the cache and evicts the oldest images over the size cap
+        :param cache_file: path of the image in the cache
+        :param png: the PNG image
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Written under a temporary name so other processes never read a partial file
+        temporary = cache_file.with_name(
+            f".{cache_file.name}.{os.getpid()}.{threading.get_ident()}"
+        )
+        temporary.write_bytes(png)
+        os.replace(temporary, cache_file)
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = sum(
+                    path.stat().st_size for path in self.cache_dir.glob("*.png")
+                )
+            else:
+                self.total_bytes += len(png)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used images until the cache is within its cap.
+        Other processes may share the directory, so the size is recounted from disk
+        """
+        images = []
+        for path in self.cache_dir.glob("*.png"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            images.append((stat.st_mtime, stat.st_size, path))
+        images.sort()
+        self.total_bytes = sum(size for _, size, _ in images)
+        for _, size, path in images:
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= size
+
+
+_renderers = {}
+
+
+def get_plot_renderer(cache_dir: str = constants.PLOT_CACHE_DIR) -> PlotRenderer:
+    """
+    :param cache_dir: directory of the rendered PNGs
+    :return: the plot renderer of this process for the directory
+    """
+    if cache_dir not in _renderers:
+        _renderers[cache_dir] = PlotRenderer(cache_dir)
+    return _renderers[cache_dir]
@@ -0,0 +1,131 @@
+import atexit
+import cProfile
+import functools
+import io
+import os
+from pathlib import Path
+import pstats
+import random
+import threading
+import time
+
+from car_purchase_help import constants
+
+
+class RequestProfiler:
+    """
+    Profiles a sampled fraction of the calls of the decorated functions with
+    cProfile. The profiles of each function are aggregated and dumped to the profile
+    directory, and every call slower than `slow_seconds` also gets its own report
+    """
+
+    def __init__(
+        self,
+        rate: float = None,
+        profile_dir: str = constants.PROFILE_DIR,
+        slow_seconds: float = constants.PROFILE_SLOW_SECONDS,
+        dump_every: int = constants.PROFILE_DUMP_EVERY,
+        force=None,
+    ) -> None:
+        """
+        Constructor
+        :param rate: fraction of the calls profiled, defaults to the PROFILE_RATE_ENV
+            environment variable or PROFILE_RATE
+        :param profile_dir: directory the profiles are written to
+        :param slow_seconds: duration above which a profiled call is reported alone
+        :param dump_every: number of profiled calls of a function between two dumps
+            of its aggregated profile
+        :param force: optional function returning whether to profile the current
+            call regardless of the rate, None if profiling can not be forced
+        """
+        if rate is None:
+            rate = os.environ.get(constants.PROFILE_RATE_ENV, constants.PROFILE_RATE)
+        self.rate = float(rate)
+        self.profile_dir = Path(profile_dir)
+        self.slow_seconds = slow_seconds
+        self.dump_every = dump_every
+        self.force = force
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.counts = {}
+        atexit.register(self.dump_all)
+
+    def profiled(self, function):
+        """
+        Decorator profiling the sampled calls of the function. When profiling is off
+        and can not be forced the function is returned as it is
+        """
+        if not self.rate and self.force is None:
+            return function
+
+        name = function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            # Calls made while the thread is already profiled are part of its profile
+            if getattr(self.local, "active", False) or not (
+                (self.rate and random.random() < self.rate)
+                or (self.force is not None and self.force())
+            ):
+                return function(*args, **kwargs)
+
+            profile = cProfile.Profile()
+            self.local.active = True
+            start = time.perf_counter()
+            try:
+                return profile.runcall(function, *args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.local.active = False
+                self.record(name, profile, elapsed)
+
+        return wrapper
+
+    def record(self, name: str, profile: cProfile.Profile, elapsed: float) -> None:
+        """
+        Adds a profiled call to the aggregate of its function
+        :param name: name of the function
+        :param profile: the profile of the call
+        :param elapsed: duration of the call in seconds
+        """
+        if elapsed > self.slow_seconds:
+            self.write_slow(name, profile, elapsed)
+        with self.lock:
+            if name in self.stats:
+                self.stats[name].add(profile)
+            else:
+                self.stats[name] = pstats.Stats(profile)
+            self.counts[name] = self.counts.get(name, 0) + 1
+            if self.counts[name] % self.dump_every == 0:
+                self.dump(name)
+
+    def write_slow(self, name: str, profile: cProfile.Profile, elapsed: float) -> None:
+        """
+        Writes the report of a single slow call, sorted by cumulative time
+        """
+        report = io.StringIO()
+        report.write(f"{name} took {elapsed:.3f}s\n")
+        pstats.Stats(profile, stream=report).sort_stats("cumulative").print_stats(40)
+        slow_dir = self.profile_dir / "slow"
+        slow_dir.mkdir(parents=True, exist_ok=True)
+        file_name = f"{name}-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+        (slow_dir / f"{file_name}-{threading.get_ident()}.txt").write_text(
+            report.getvalue()
+        )
+
+    def dump(self, name: str) -> None:
+        """
+        Writes the aggregated profile of a function, readable with `pstats.Stats`.
+        Must be called with the lock held
+        """
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        dump_file = self.profile_dir / f"{name}-{os.getpid()}.prof"
+        tmp_file = dump_file.with_suffix(".tmp")
+        self.stats[name].dump_stats(tmp_file)
+        os.replace(tmp_file, dump_file)
+
+    def dump_all(self) -> None:
+        with self.lock:
+            for name in self.stats:
+                self.dump(name)
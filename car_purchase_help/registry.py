@@ -0,0 +1,169 @@
+from collections import OrderedDict
+from pathlib import Path
+import pickle
+import threading
+
+from car_purchase_help import constants
+from car_purchase_help.linear_regression import CompactRegression, Linear_Regression
+from car_purchase_help.metrics import (
+    REGISTRY_ENTRIES,
+    REGISTRY_EVICTIONS,
+    REGISTRY_HITS,
+    REGISTRY_MISSES,
+    STAGE_LATENCY,
+)
+from car_purchase_help.model_store import model_key
+
+
+class ModelRegistry:
+    """
+    Process wide cache of the pickled regressions. Each regression is unpickled
+    once and kept, as a CompactRegression of a few hundred bytes, until the entry
+    budget forces the least recently used one out
+    """
+
+    def __init__(
+        self,
+        models_dir: str = constants.MODELS_DIR,
+        max_entries: int = constants.REGISTRY_MAX_ENTRIES,
+    ) -> None:
+        """
+        Constructor
+        :param models_dir: directory containing the `manufacturer_model_year.pkl` files
+        :param max_entries: maximum number of regressions kept
+        """
+        self.models_dir = Path(models_dir)
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def model_file(self, manufacturer: str, model: str, year: int) -> Path:
+        """
+        :return: the compact pickle of the car if it has been migrated, otherwise
+            the original pickle
+        """
+        file_name = f"{model_key(manufacturer, model, year)}.pkl"
+        compact_file = self.models_dir / constants.COMPACT_MODELS_SUBDIR / file_name
+        if compact_file.exists():
+            return compact_file
+        return self.models_dir / file_name
+
+    def has_model(self, manufacturer: str, model: str, year: int) -> bool:
+        """
+        :return: whether a regression exists for the car, loaded or not
+        """
+        key = model_key(manufacturer, model, year)
+        if key in self.entries:
+            return True
+        return self.model_file(manufacturer, model, year).exists()
+
+    def get(self, manufacturer: str, model: str, year: int):
+        """
+        Returns the regression for the car, unpickling it on the first request. Only
+        the compact form is kept, not the training data of the original pickle
+        :param manufacturer: cleaned manufacturer of the vehicle
+        :param model: cleaned model of the vehicle
+        :param year: year of manufacture
+        :return: the CompactRegression for the car
+        """
+        key = model_key(manufacturer, model, year)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                REGISTRY_HITS.inc()
+                return self.entries[key]
+            self.misses += 1
+            REGISTRY_MISSES.inc()
+
+            model_file = self.model_file(manufacturer, model, year)
+            assert (
+                model_file.exists()
+            ), "No regression model for this car from that year"
+            with STAGE_LATENCY.labels("model_load").time():
+                with open(model_file, "rb") as f:
+                    linreg = pickle.load(f)
+                if isinstance(linreg, Linear_Regression):
+                    linreg = CompactRegression.from_linear_regression(linreg)
+            self._insert(key, linreg)
+            return linreg
+
+    def _insert(self, key: str, linreg) -> None:
+        """
+        Adds a regression then evicts least recently used ones until the budget holds.
+        Must be called with the lock held
+        """
+        self.entries[key] = linreg
+        REGISTRY_ENTRIES.inc()
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+            REGISTRY_EVICTIONS.inc()
+            REGISTRY_ENTRIES.dec()
+
+    def preload(self, manufacturers="all", warm_up: bool = True) -> int:
+        """
+        Loads regressions ahead of the first request
+        :param manufacturers: list of manufacturers to load or "all" for every regression
+        :param warm_up: run one prediction per regression so the first request does
+            not pay for it
+        :return: number of regressions loaded
+        """
+        if manufacturers == "all":
+            model_files = self.models_dir.glob("*.pkl")
+        else:
+            model_files = [
+                model_file
+                for manufacturer in manufacturers
+                for model_file in self.models_dir.glob(f"{manufacturer}_*.pkl")
+            ]
+
+        loaded = 0
+        for model_file in sorted(model_files):
+            manufacturer, model_year = model_file.stem.split("_", 1)
+            model, year = model_year.rsplit("_", 1)
+            linreg = self.get(manufacturer, model, year)
+            if warm_up:
+                linreg.predict(x=constants.MILEAGE_DECREASE_PERIOD)
+            loaded += 1
+        return loaded
+
+    def clear(self) -> None:
+        with self.lock:
+            REGISTRY_ENTRIES.dec(len(self.entries))
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        """
+        :return: dictionary of the registry counters
+        """
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+_registries = {}
+
+
+def get_registry(models_dir: str = constants.MODELS_DIR) -> ModelRegistry:
+    """
+    :param models_dir: directory containing the pkl files
+    :return: the single registry of the process for that directory
+    """
+    if models_dir not in _registries:
+        _registries[models_dir] = ModelRegistry(models_dir)
+    return _registries[models_dir]
+
+
+def clear_registries() -> None:
+    """
+    Drops the regressions loaded by every registry of the process
+    """
+    for registry in _registries.values():
+        registry.clear()
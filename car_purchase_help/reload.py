@@ -0,0 +1,105 @@
+import os
+import signal
+import threading
+
+import numpy as np
+
+from car_purchase_help import constants
+from car_purchase_help.catalog import Catalog, replace_catalog
+from car_purchase_help.metrics import STAGE_LATENCY, set_model_version
+from car_purchase_help.model_store import (
+    current_version,
+    loaded_model_store,
+    replace_model_store,
+    ModelStore,
+    KEYS_FILE,
+)
+from car_purchase_help.registry import clear_registries
+from car_purchase_help.similar_cars import (
+    read_similar_cars_index,
+    replace_similar_cars_index,
+    SimilarCarsIndex,
+)
+
+_reload_lock = threading.Lock()
+# Set in the gunicorn workers, which leave reloading to the master
+_master_pid = None
+
+
+def live_version(store_dir: str = constants.MODEL_STORE_DIR) -> str:
+    """
+    :param store_dir: directory of the model store
+    :return: version of the model store served by this process, None before it is
+        loaded
+    """
+    store = loaded_model_store(store_dir)
+    return None if store is None else store.version
+
+
+def reload_models(
+    store_dir: str = constants.MODEL_STORE_DIR,
+    index_path: str = constants.SIMILAR_CARS_INDEX_PATH,
+) -> str:
+    """
+    Switches to the version of the model store currently published. The new store,
+    its catalog and similar cars index are loaded and warmed while the old ones keep
+    serving, then swapped in. The regressions loaded from the pickles are dropped
+    :param store_dir: directory of the model store
+    :param index_path: path of the similar cars index
+    :return: the version now served
+    """
+    with _reload_lock:
+        version, version_dir = current_version(store_dir)
+        if version == live_version(store_dir):
+            return version
+        assert (version_dir / KEYS_FILE).exists(), f"No model store in {version_dir}"
+
+        with STAGE_LATENCY.labels("model_load").time():
+            store = ModelStore(store_dir)
+            # Fault the memory mapped pages in so the first requests do not
+            np.asarray(store.coefficients).sum()
+            catalog = Catalog.from_store(store)
+            index = SimilarCarsIndex(read_similar_cars_index(index_path), store)
+
+        replace_model_store(store_dir, store)
+        replace_catalog(store_dir, catalog)
+        replace_similar_cars_index(index_path, index)
+        clear_registries()
+        set_model_version(store.version)
+        return store.version
+
+
+def reload_in_background(store_dir: str = constants.MODEL_STORE_DIR) -> None:
+    """
+    Runs `reload_models` in a thread so requests keep being served meanwhile
+    :param store_dir: directory of the model store
+    """
+    threading.Thread(target=reload_models, args=(store_dir,), daemon=True).start()
+
+
+def request_reload() -> None:
+    """
+    Reloads the models of every process serving the app. Under gunicorn the master
+    is sent SIGHUP, it reloads then replaces its workers by ones forked from it
+    """
+    if _master_pid is not None:
+        os.kill(_master_pid, signal.SIGHUP)
+    else:
+        reload_in_background()
+
+
+def set_master_pid(pid: int) -> None:
+    """
+    Called in each gunicorn worker after it is forked
+    :param pid: process id of the gunicorn master
+    """
+    global _master_pid
+    _master_pid = pid
+
+
+def install_signal_handler() -> None:
+    """
+    Reloads the models in the background when the process receives SIGHUP. Used by
+    the development server, gunicorn handles SIGHUP itself
+    """
+    signal.signal(signal.SIGHUP, lambda signum, frame: reload_in_background())
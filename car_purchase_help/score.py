@@ -0,0 +1,178 @@
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import os
+from pathlib import Path
+
+import pandas as pd
+
+from car_purchase_help import constants
+from car_purchase_help.ingest import INGEST_DTYPES
+from car_purchase_help.model1 import predict_prices
+
+# Columns added to every listing by `score_chunk`
+SCORE_COLUMNS = [
+    "predicted_price",
+    "mean_absolute_residual",
+    "deal",
+    "mileage_decrease",
+    "reason",
+]
+
+
+def score_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    """
+    Scores a chunk of listings with `predict_prices`
+    :param chunk: dataframe with the columns `manufacturer`, `model`, `year`,
+        `odometer` and optionally the listed `price`
+    :return: the chunk with the SCORE_COLUMNS added. Rows which could not be priced
+        have a reason code from REASON_CODES instead of a price
+    """
+    scores = predict_prices(chunk)
+    chunk = chunk.copy()
+    for column in SCORE_COLUMNS:
+        chunk[column] = scores[column]
+    return chunk
+
+
+def read_chunks(input_path: str, chunksize: int = constants.SCORE_CHUNKSIZE):
+    """
+    Streams the listings of a csv, a parquet file or a directory of parquet files
+    such as the cache written by the ingest
+    :param input_path: path of the listings
+    :param chunksize: number of csv rows read at a time, parquet files are read one
+        row group at a time
+    :return: generator of dataframes, the columns of vehicles.csv have the types of
+        the ingest in every chunk
+    """
+    input_path = Path(input_path)
+    if input_path.suffix == ".csv":
+        yield from pd.read_csv(input_path, dtype=INGEST_DTYPES, chunksize=chunksize)
+        return
+
+    import pyarrow.parquet as pq
+
+    if input_path.is_dir():
+        parts = sorted(input_path.glob("**/*.parquet"))
+    else:
+        parts = [input_path]
+    for part in parts:
+        parquet_file = pq.ParquetFile(part)
+        for row_group in range(parquet_file.num_row_groups):
+            chunk = parquet_file.read_row_group(row_group).to_pandas()
+            # Partitioned caches keep the column in the directory name
+            column, _, value = part.parent.name.partition("=")
+            if value and column not in chunk.columns:
+                chunk[column] = value
+            yield chunk
+
+
+class ChunkWriter:
+    """
+    Appends scored chunks to a csv or parquet file as they arrive
+    """
+
+    def __init__(self, output_path: str) -> None:
+        """
+        Constructor
+        :param output_path: path of the output, its extension gives the format
+        """
+        self.output_path = Path(output_path)
+        self.parquet = self.output_path.suffix == ".parquet"
+        self.writer = None
+        self.rows = 0
+
+    def write(self, chunk: pd.DataFrame) -> None:
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self.writer is None:
+                # A column without any value in the first chunk has no type yet
+                schema = pa.schema(
+                    [
+                        field.with_type(pa.string())
+                        if pa.types.is_null(field.type)
+                        else field
+                        for field in table.schema
+                    ],
+                    metadata=table.schema.metadata,
+                )
+                self.writer = pq.ParquetWriter(self.output_path, schema)
+            # The types inferred from a later chunk may differ, eg an integer odometer
+            self.writer.write_table(table.cast(self.writer.schema))
+        else:
+            chunk.to_csv(
+                self.output_path,
+                mode="a" if self.rows else "w",
+                header=not self.rows,
+                index=False,
+            )
+        self.rows += len(chunk)
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def remove(self) -> None:
+        """
+        Closes and deletes the output, so that a failed run leaves no truncated file
+        """
+        self.close()
+        if self.output_path.exists():
+            self.output_path.unlink()
+
+
+def score_file(
+    input_path: str,
+    output_path: str,
+    chunksize: int = constants.SCORE_CHUNKSIZE,
+    workers: int = os.cpu_count() or 1,
+) -> int:
+    """
+    Scores every listing of a file, streaming it chunk by chunk across a process
+    pool. At most two chunks per process are held in memory at once and the output
+    keeps the order of the input
+    :param input_path: path of a csv, a parquet file or a directory of parquet files
+    :param output_path: path of the csv or parquet file written
+    :param chunksize: number of csv rows scored at a time
+    :param workers: number of processes, 1 scores in this process
+    :return: number of listings scored
+    """
+    writer = ChunkWriter(output_path)
+    try:
+        if workers == 1:
+            for chunk in read_chunks(input_path, chunksize):
+                writer.write(score_chunk(chunk))
+            return writer.rows
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for chunk in read_chunks(input_path, chunksize):
+                if len(pending) >= 2 * workers:
+                    writer.write(pending.popleft().result())
+                pending.append(executor.submit(score_chunk, chunk))
+            while pending:
+                writer.write(pending.popleft().result())
+        return writer.rows
+    except BaseException:
+        writer.remove()
+        raise
+    finally:
+        writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Attach the predicted price, deal and mileage cost to every "
+        "listing of a csv or parquet file"
+    )
+    parser.add_argument("input", help="csv, parquet file or directory of parquet files")
+    parser.add_argument("output", help="csv or parquet file written")
+    parser.add_argument("--chunksize", type=int, default=constants.SCORE_CHUNKSIZE)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    rows = score_file(args.input, args.output, args.chunksize, args.workers)
+    print(f"Scored {rows} listings into {args.output}")
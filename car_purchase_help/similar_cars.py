@@ -0,0 +1,201 @@
+import argparse
+import ast
+from pathlib import Path
+
+import numpy as np
+
+from car_purchase_help import constants
+from car_purchase_help.model_store import load_model_store, INTERCEPT
+from car_purchase_help.registry import get_registry
+
+
+def compile_similar_cars(similar_cars: dict) -> dict:
+    """
+    Compiles the dictionary of similar cars into arrays. Every car gets an integer id
+    in sorted order and the similar cars of car `i` are
+    `indices[indptr[i]:indptr[i + 1]]`
+    :param similar_cars: dictionary of `manufacturer_model` to the set of similar
+        `manufacturer_model` as written by `clean_similar_cars_dict`
+    :return: dictionary of the arrays `manufacturers`, `models`, `has_entry`,
+        `indptr` and `indices`
+    """
+    names = set(similar_cars)
+    for cars in similar_cars.values():
+        names.update(cars)
+    names = sorted(names)
+    car_ids = {name: i for i, name in enumerate(names)}
+    # Manufacturers never contain an underscore but models may
+    split = [name.split("_", 1) for name in names]
+
+    indptr = [0]
+    indices = []
+    for name in names:
+        indices.extend(sorted(car_ids[car] for car in similar_cars.get(name, ())))
+        indptr.append(len(indices))
+
+    return {
+        "manufacturers": np.array([manufacturer for manufacturer, _ in split]),
+        "models": np.array([model for _, model in split]),
+        "has_entry": np.array([name in similar_cars for name in names]),
+        "indptr": np.array(indptr, dtype=np.int32),
+        "indices": np.array(indices, dtype=np.int32),
+    }
+
+
+def read_similar_cars(similar_cars_path: str = constants.SIMILAR_CARS_PATH) -> dict:
+    """
+    :param similar_cars_path: path of the cleaned similar cars dictionary
+    :return: the compiled arrays of `compile_similar_cars`
+    """
+    with open(similar_cars_path, "r") as f:
+        return compile_similar_cars(ast.literal_eval(f.read()))
+
+
+def build_similar_cars_index(
+    similar_cars_path: str = constants.SIMILAR_CARS_PATH,
+    index_path: str = constants.SIMILAR_CARS_INDEX_PATH,
+) -> int:
+    """
+    Compiles the similar cars dictionary and saves the arrays so the app does not
+    need to parse the Python literal
+    :param similar_cars_path: path of the cleaned similar cars dictionary
+    :param index_path: path of the npz file written
+    :return: number of cars in the index
+    """
+    arrays = read_similar_cars(similar_cars_path)
+    np.savez(index_path, **arrays)
+    return len(arrays["manufacturers"])
+
+
+class SimilarCarsIndex:
+    """
+    Compiled similar cars joined with the years for which each car has a regression
+    """
+
+    def __init__(self, arrays: dict, store=None) -> None:
+        """
+        Constructor
+        :param arrays: dictionary of arrays as returned by `compile_similar_cars`
+        :param store: ModelStore to find the regressions in, defaults to the one
+            loaded by `load_model_store`
+        """
+        self.manufacturers = arrays["manufacturers"]
+        self.models = arrays["models"]
+        self.has_entry = arrays["has_entry"]
+        self.indptr = arrays["indptr"]
+        self.indices = arrays["indices"]
+        self.car_ids = {
+            (manufacturer, model): i
+            for i, (manufacturer, model) in enumerate(
+                zip(self.manufacturers, self.models)
+            )
+        }
+        self.available = self.find_available(store)
+
+    def find_available(self, store=None) -> np.ndarray:
+        """
+        :param store: ModelStore to find the regressions in, defaults to the one
+            loaded by `load_model_store`
+        :return: boolean array of shape (number of cars, number of YEARS) of the
+            car and year combinations that have a regression
+        """
+        years = np.array(constants.YEARS)
+        manufacturers = np.repeat(self.manufacturers, len(years))
+        models = np.repeat(self.models, len(years))
+        year_text = np.tile(years.astype(str), len(self.manufacturers))
+        keys = np.char.add(
+            np.char.add(np.char.add(manufacturers, "_"), np.char.add(models, "_")),
+            year_text,
+        )
+
+        if store is None:
+            store = load_model_store()
+        if store is not None:
+            idx = store.index_many(keys)
+            available = idx >= 0
+            available[available] = ~np.isnan(
+                store.coefficients[idx[available], INTERCEPT]
+            )
+        else:
+            registry = get_registry()
+            available = np.array(
+                [
+                    registry.has_model(manufacturer, model, year)
+                    for manufacturer, model, year in zip(
+                        manufacturers, models, np.tile(years, len(self.manufacturers))
+                    )
+                ],
+                dtype=bool,
+            )
+        return available.reshape(len(self.manufacturers), len(years))
+
+    def similar_cars(self, manufacturer: str, model: str, year: int):
+        """
+        :param manufacturer: cleaned manufacturer of the vehicle
+        :param model: cleaned model of the vehicle
+        :param year: year of manufacture
+        :return: tuple of the manufacturer and model arrays of the similar cars which
+            have a regression for the year, or None if the car has no similar cars listed
+        """
+        i = self.car_ids.get((manufacturer, model))
+        if i is None or not self.has_entry[i]:
+            return None
+        neighbours = self.indices[self.indptr[i] : self.indptr[i + 1]]
+        if year in constants.YEARS:
+            year_column = year - constants.YEARS[0]
+            neighbours = neighbours[self.available[neighbours, year_column]]
+        else:
+            neighbours = neighbours[:0]
+        return self.manufacturers[neighbours], self.models[neighbours]
+
+
+_indexes = {}
+
+
+def load_similar_cars_index(
+    index_path: str = constants.SIMILAR_CARS_INDEX_PATH,
+) -> SimilarCarsIndex:
+    """
+    Loads the index once per process, compiling the similar cars dictionary if the
+    index has not been built
+    :param index_path: path of the npz file written by `build_similar_cars_index`
+    :return: the SimilarCarsIndex
+    """
+    if index_path not in _indexes:
+        _indexes[index_path] = SimilarCarsIndex(read_similar_cars_index(index_path))
+    return _indexes[index_path]
+
+
+def replace_similar_cars_index(index_path: str, index: SimilarCarsIndex) -> None:
+    """
+    Serves `index` from now on in place of the one loaded by
+    `load_similar_cars_index`
+    :param index_path: path of the npz file written by `build_similar_cars_index`
+    :param index: the SimilarCarsIndex of the new version of the store
+    """
+    _indexes[index_path] = index
+
+
+def read_similar_cars_index(
+    index_path: str = constants.SIMILAR_CARS_INDEX_PATH,
+) -> dict:
+    """
+    :param index_path: path of the npz file written by `build_similar_cars_index`
+    :return: dictionary of arrays as returned by `compile_similar_cars`, compiled from
+        the similar cars dictionary if the index has not been built
+    """
+    if Path(index_path).exists():
+        with np.load(index_path) as arrays:
+            return dict(arrays)
+    return read_similar_cars()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compile the similar cars dictionary into an index"
+    )
+    parser.add_argument("--similar-cars", default=constants.SIMILAR_CARS_PATH)
+    parser.add_argument("--index", default=constants.SIMILAR_CARS_INDEX_PATH)
+    args = parser.parse_args()
+    count = build_similar_cars_index(args.similar_cars, args.index)
+    print(f"Wrote {count} cars to {args.index}")
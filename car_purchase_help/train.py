@@ -0,0 +1,234 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from car_purchase_help import constants
+from car_purchase_help.data_processing import format_raw_df, split_by_description_hash
+from car_purchase_help.ingest import load_cache
+from car_purchase_help.fitting import (
+    fit_grouped_regressions,
+    prepare_training_frame,
+    training_keys,
+)
+from car_purchase_help.model_store import (
+    publish_model_store,
+    CANDIDATE_DIR,
+    read_model_store,
+    write_model_store,
+    COEFFICIENT_COLUMNS,
+    STAT_COLUMNS,
+)
+
+MANIFEST_FILE = "manifest.json"
+
+
+def hash_groups(data: pd.DataFrame, keys: pd.Series) -> dict:
+    """
+    Hashes the input rows of every group. The row hashes are summed so the hash does
+    not depend on the order of the rows. The columns are cast to fixed types so the
+    hash does not depend on how they were downcast
+    :param data: dataframe returned by `prepare_training_frame`
+    :param keys: key of every row
+    :return: dictionary of key to hash
+    """
+    row_hashes = pd.util.hash_pandas_object(
+        data[["odometer", "price"]].astype({"odometer": np.int64, "price": np.float64}),
+        index=False,
+    ).astype(np.uint64)
+    grouped = row_hashes.groupby(keys.values, observed=True)
+    sums = grouped.sum()
+    counts = grouped.size()
+    return {key: f"{int(counts[key])}-{int(sums[key]):016x}" for key in sums.index}
+
+
+def load_manifest(store_dir: str) -> dict:
+    """
+    :param store_dir: directory of the model store
+    :return: dictionary of key to data hash of the groups already processed
+    """
+    manifest_file = Path(store_dir) / MANIFEST_FILE
+    if not manifest_file.exists():
+        return {}
+    with open(manifest_file, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: dict, store_dir: str) -> None:
+    """
+    Writes the manifest atomically so an interrupted run never leaves it half written
+    :param manifest: dictionary of key to data hash
+    :param store_dir: directory of the model store
+    """
+    manifest_file = Path(store_dir) / MANIFEST_FILE
+    tmp_file = manifest_file.with_suffix(".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(manifest, f, sort_keys=True)
+    os.replace(tmp_file, manifest_file)
+
+
+def load_fitted(store_dir: str) -> dict:
+    """
+    :param store_dir: directory of the model store
+    :return: dictionary of key to coefficients followed by statistics of the groups
+        already in the store
+    """
+    keys, coefficients, stats = read_model_store(store_dir)
+    return {
+        str(key): values for key, values in zip(keys, np.hstack([coefficients, stats]))
+    }
+
+
+def save_fitted(fitted: dict, manifest: dict, store_dir: str) -> None:
+    """
+    Writes the store before the manifest so a group is never marked finished
+    without its regression being saved
+    :param fitted: dictionary of key to coefficients followed by statistics
+    :param manifest: dictionary of key to data hash
+    :param store_dir: directory of the model store
+    """
+    values = np.array(list(fitted.values())).reshape(
+        len(fitted), len(COEFFICIENT_COLUMNS) + len(STAT_COLUMNS)
+    )
+    write_model_store(
+        list(fitted.keys()),
+        values[:, : len(COEFFICIENT_COLUMNS)],
+        store_dir,
+        values[:, len(COEFFICIENT_COLUMNS) :],
+    )
+    save_manifest(manifest, store_dir)
+
+
+def shard_groups(data: pd.DataFrame, keys: pd.Series, n_shards: int) -> list:
+    """
+    Splits the rows into shards of whole groups with roughly equal numbers of rows
+    :param data: dataframe returned by `prepare_training_frame`
+    :param keys: key of every row
+    :param n_shards: number of shards
+    :return: list of (keys in the shard, dataframe of the shard)
+    """
+    sizes = keys.value_counts()
+    # Deal the largest groups out first so the shards stay balanced
+    shard_of_key = pd.Series(np.arange(len(sizes)) % n_shards, index=sizes.index)
+    row_shard = shard_of_key.reindex(keys.values).values
+    shards = []
+    for shard in range(n_shards):
+        mask = row_shard == shard
+        if mask.any():
+            shards.append((list(sizes.index[shard::n_shards]), data[mask]))
+    return shards
+
+
+def train(
+    data: pd.DataFrame,
+    store_dir: str = constants.MODEL_STORE_DIR,
+    workers: int = os.cpu_count() or 1,
+    force: bool = False,
+) -> dict:
+    """
+    Fits the regressions of every group whose input rows changed since the last run,
+    sharding the groups across a process pool. The regressions are written to the
+    candidate of the store, not to the version served, and the candidate and its
+    manifest are updated as each shard finishes so an interrupted run resumes where
+    it stopped. Publish the candidate with `publish_model_store`
+    :param data: dataframe containing the data (assumed to be clean and formatted)
+    :param store_dir: directory of the model store, the candidate is written to its
+        CANDIDATE_DIR
+    :param workers: number of processes
+    :param force: refit every group regardless of the manifest
+    :return: dictionary counting the groups that were unchanged, refit and removed
+    """
+    store_dir = Path(store_dir) / CANDIDATE_DIR
+    data = prepare_training_frame(data)
+    keys = training_keys(data)
+    hashes = hash_groups(data, keys)
+
+    manifest = {} if force else load_manifest(store_dir)
+    fitted = load_fitted(store_dir)
+
+    # Forget the groups that are no longer in the data, including groups of the
+    # candidate that no manifest recorded
+    removed = sorted((set(manifest) | set(fitted)) - set(hashes))
+    for key in removed:
+        manifest.pop(key, None)
+        fitted.pop(key, None)
+
+    changed = [key for key, value in hashes.items() if manifest.get(key) != value]
+    changed_mask = keys.isin(changed).values
+    shards = shard_groups(data[changed_mask], keys[changed_mask], max(1, workers * 4))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(fit_grouped_regressions, shard): shard_keys
+            for shard_keys, shard in shards
+        }
+        for future in as_completed(futures):
+            fits = future.result()
+            shard_keys = futures[future]
+            # Groups with too few points are stored with their statistics only
+            for key in shard_keys:
+                fitted.pop(key, None)
+                manifest[key] = hashes[key]
+            for key, values in zip(
+                fits["key"].values, fits[COEFFICIENT_COLUMNS + STAT_COLUMNS].values,
+            ):
+                fitted[key] = values
+
+            save_fitted(fitted, manifest, store_dir)
+
+    if removed and not shards:
+        save_fitted(fitted, manifest, store_dir)
+
+    return {
+        "unchanged": len(hashes) - len(changed),
+        "refit": len(changed),
+        "removed": len(removed),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fit the regressions of every car in parallel, skipping the "
+        "groups whose data has not changed since the last run"
+    )
+    parser.add_argument(
+        "--data",
+        default=constants.VEHICLES_CSV,
+        help="vehicles.csv or the directory of the cache written by the ingest",
+    )
+    parser.add_argument("--store-dir", default=constants.MODEL_STORE_DIR)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--force", action="store_true", help="refit every group")
+    parser.add_argument(
+        "--train-split",
+        action="store_true",
+        help="only fit on the training set, holding out the test set by description",
+    )
+    parser.add_argument(
+        "--no-publish",
+        action="store_true",
+        help="only write the candidate store, for example to evaluate it before "
+        "publishing it with `evaluation --candidate --publish`",
+    )
+    args = parser.parse_args()
+
+    if Path(args.data).is_dir():
+        df = load_cache(
+            args.data,
+            columns=["model", "year", "odometer", "price"],
+            split="train" if args.train_split else None,
+        )
+    else:
+        df = format_raw_df(pd.read_csv(args.data))
+        if args.train_split:
+            df, _ = split_by_description_hash(df)
+    print(train(df, args.store_dir, args.workers, args.force))
+    if not args.no_publish:
+        version = publish_model_store(
+            args.store_dir, source_dir=Path(args.store_dir) / CANDIDATE_DIR
+        )
+        print(f"Published version {version}")
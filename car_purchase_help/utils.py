@@ -1,4 +1,3 @@
-import pandas as pd
 from car_purchase_help import constants
 
 
@@ -19,10 +18,10 @@ def clean_input(
     year = int(year)
     odometer = int(odometer)
 
-    assert manufacturer in constants.MANUFACTURERS, "Manufacturer does not exist"
-    # Over 28,000 models to check. Unsure how to check without loading the dataframe
-    # assert model in constants.MODELS, "Model does not exist"
-    assert year in constants.YEARS, "Year not valid, must be > 1980 and < 2019"
+    assert manufacturer in constants.MANUFACTURER_SET, "Manufacturer does not exist"
+    # Over 28,000 models to check, the models with a regression are checked
+    # against the catalog before running any model
+    assert year in constants.YEAR_SET, "Year not valid, must be > 1980 and < 2019"
     assert (
         0 < odometer < constants.MAX_ODOMETER
     ), f"Mileage not valid, must be > 0 and < {constants.MAX_ODOMETER}"
@@ -54,6 +53,19 @@ def format_user_input(text: str) -> (str, str, int, int, int):
     )
 
 
+def clean_user_input(text: str) -> (str, str, int, int, int):
+    """
+    Formats then cleans the user input
+    :param text: `manufacturer, model, year, mileage, listed price`
+    :return: tuple of cleaned manufacturer, model, year, mileage, listed price
+    """
+    manufacturer, model, year, odometer, listed_price = format_user_input(text)
+    manufacturer, model, year, odometer = clean_input(
+        manufacturer, model, year, odometer
+    )
+    return manufacturer, model, year, odometer, listed_price
+
+
 def format_file_name(text: str):
     """
     Formats a filename to be savable by removing problem characters
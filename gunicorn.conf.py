@@ -0,0 +1,51 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("THREADS", 1))
+# Import the app, and so warm it up, in the master before forking the workers
+preload_app = True
+timeout = 30
+accesslog = "-"
+
+# Every process writes its metrics to this directory so a scrape of any worker
+# aggregates them all. It must be set before the app, and so prometheus_client, is
+# imported. It is emptied when gunicorn starts, but not when the configuration is
+# read again on SIGHUP as the running processes still write to it
+metrics_dir = os.environ.setdefault(
+    "prometheus_multiproc_dir", os.path.join(tempfile.gettempdir(), "car_help_metrics")
+)
+if os.environ.get("CAR_HELP_METRICS_DIR_CLEANED") != metrics_dir:
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+    os.environ["CAR_HELP_METRICS_DIR_CLEANED"] = metrics_dir
+
+
+def on_reload(server):
+    # SIGHUP to the master: load and warm the newly published models in the master
+    # while the old workers keep serving, the new workers are then forked from it
+    from car_purchase_help.reload import reload_models
+
+    reload_models()
+
+
+def post_fork(server, worker):
+    # Reloads requested through the admin endpoint go through the master
+    from car_purchase_help.metrics import set_model_version
+    from car_purchase_help.reload import live_version, set_master_pid
+
+    set_master_pid(server.pid)
+    # The store was loaded in the master, export its version from this worker too
+    if live_version() is not None:
+        set_model_version(live_version())
+
+
+def child_exit(server, worker):
+    # Drop the live gauges of the worker, such as the model version it served
+    if "prometheus_multiproc_dir" in os.environ:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
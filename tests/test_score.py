@@ -0,0 +1,40 @@
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from car_purchase_help.score import ChunkWriter, read_chunks
+
+
+def test_chunk_writer_casts_later_chunks_to_the_first_schema(tmp_path):
+    output_path = tmp_path / "scored.parquet"
+    writer = ChunkWriter(output_path)
+    writer.write(pd.DataFrame({"odometer": [1000.5, 2000.0], "condition": [None] * 2}))
+    writer.write(pd.DataFrame({"odometer": [3000, 4000], "condition": ["good"] * 2}))
+    writer.close()
+
+    scored = pq.read_table(output_path).to_pandas()
+    assert writer.rows == 4
+    assert scored["odometer"].tolist() == [1000.5, 2000.0, 3000.0, 4000.0]
+    assert scored["condition"].isna().tolist() == [True, True, False, False]
+    assert scored["condition"].iloc[2:].tolist() == ["good", "good"]
+
+
+def test_chunk_writer_remove_deletes_the_partial_output(tmp_path):
+    output_path = tmp_path / "scored.parquet"
+    writer = ChunkWriter(output_path)
+    writer.write(pd.DataFrame({"odometer": [1000.5]}))
+    with pytest.raises(Exception):
+        writer.write(pd.DataFrame({"odometer": ["unknown"]}))
+    writer.remove()
+    assert not output_path.exists()
+
+
+def test_read_chunks_keeps_the_ingest_types_of_every_csv_chunk(tmp_path):
+    input_path = tmp_path / "vehicles.csv"
+    pd.DataFrame({"manufacturer": ["ford", "1"], "odometer": [1000, 2000.5]}).to_csv(
+        input_path, index=False
+    )
+
+    chunks = list(read_chunks(input_path, chunksize=1))
+    assert [chunk["odometer"].dtype for chunk in chunks] == ["float64"] * 2
+    assert chunks[1]["manufacturer"].tolist() == ["1"]
@@ -0,0 +1,13 @@
+"""
+Production entry point, run with `gunicorn -c gunicorn.conf.py wsgi:app`.
+The app is warmed up at import so with `preload_app` the model data is loaded once
+in the master and shared with the forked workers
+"""
+import gc
+
+from application import app, warm_up
+
+warm_up()
+# Move everything loaded so far out of the garbage collector's generations so
+# collections in the workers do not touch, and so copy, the shared pages
+gc.freeze()